@@ -200,5 +200,8 @@ module "cloud_function" {
   event_trigger_bucket  = var.cloud_storage_trigger_bucket_name
   source_code_bucket    = var.cloud_storage_source_code_bucket_name
 
+  max_instance_request_concurrency = var.cloud_function_max_instance_request_concurrency
+  etl_environment_variables        = var.cloud_function_etl_environment_variables
+
   depends_on = [module.secret_manager, module.dashboard]
 }
\ No newline at end of file
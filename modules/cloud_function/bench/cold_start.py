@@ -0,0 +1,111 @@
+"""Measure the cold start of each path through the entry point.
+
+Every sample runs in a fresh interpreter, as on a new instance: it times
+``import main`` and the first ``etl`` call, and lists which heavy packages
+ended up imported.
+
+    python cold_start.py --repeat 5
+    python cold_start.py --data-dir DATA_DIR --file AGE_MONTHLY.csv \\
+        --dsn "host=localhost dbname=bench user=postgres" --output cold_start.json
+
+Paths: ``skip_not_csv`` (an object that is not a CSV or Parquet file),
+``skip_unregistered`` (a CSV without an ETL function) and, with
+``--data-dir`` and ``--dsn``, ``load`` (the given file, best kept small).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Packages whose import dominates the start of an instance
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'psycopg2', 'google.cloud.storage', 'google.cloud.secretmanager')
+
+# Run by each fresh interpreter; prints one JSON sample
+SAMPLE = '''
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.etl(json.loads(sys.argv[1]), None)
+finished = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'first_call_seconds': finished - imported,
+    'modules': [name for name in json.loads(sys.argv[2]) if name in sys.modules],
+}))
+'''
+
+
+def sample(event: dict, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', SAMPLE, json.dumps(event), json.dumps(HEAVY_MODULES)],
+        cwd=SRC_DIR, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(event: dict, env: dict, repeat: int) -> dict:
+    samples = [sample(event, env) for _ in range(repeat)]
+    result = {
+        name: statistics.median(s[name] for s in samples)
+        for name in ('import_seconds', 'first_call_seconds')
+    }
+    result['total_seconds'] = result['import_seconds'] + result['first_call_seconds']
+    result['modules'] = samples[-1]['modules']
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per path; the median is kept')
+    parser.add_argument('--data-dir', help='directory standing in for the trigger bucket')
+    parser.add_argument('--file', default='AGE_MONTHLY.csv', help='file of --data-dir loaded by the load path')
+    parser.add_argument('--dsn', default=os.getenv('ETL_DATABASE_DSN'), help='libpq connection string')
+    parser.add_argument('--output', help='write the results as JSON to this file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, ETL_METRICS_EXPORTER='none')
+    paths = {
+        'skip_not_csv': {'bucket': 'bench', 'name': 'report.pdf', 'size': 0},
+        'skip_unregistered': {'bucket': 'bench', 'name': 'UNKNOWN_MONTHLY.csv', 'size': 0},
+    }
+    if args.data_dir and args.dsn:
+        data_dir = os.path.abspath(args.data_dir)
+        env.update(
+            ETL_DATABASE_DSN=args.dsn,
+            ETL_LOCAL_BUCKET_DIR=os.path.dirname(data_dir),
+            # Every sample loads the same object again, which the manifest would skip
+            ETL_LOAD_MANIFEST='0',
+        )
+        paths['load'] = {
+            'bucket': os.path.basename(data_dir),
+            'name': args.file,
+            'size': os.path.getsize(os.path.join(data_dir, args.file)),
+        }
+
+    results = {}
+    for path, event in paths.items():
+        results[path] = measure(event, env, args.repeat)
+        print(
+            f"{path}: import {results[path]['import_seconds']:.3f}s, "
+            f"first call {results[path]['first_call_seconds']:.3f}s, "
+            f"heavy modules: {', '.join(results[path]['modules']) or 'none'}",
+            file=sys.stderr,
+        )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Generate synthetic upload files for every registered ETL dataset.
+
+The columns of each file come from the dataset's ColumnManifest in
+``src/processing.py``, so the generated files always match what the ETL reads.
+
+    python generate.py OUTPUT_DIR --rows 1000000 --polygons 50000 --null-rate 0.01
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from processing import DATASETS  # noqa: E402
+
+
+# Rows generated and written at a time, so 50M-row files fit in memory
+BATCH_ROWS = 1_000_000
+
+# Labels of the categorical columns, as they appear in the uploads
+COLUMN_VALUES = {
+    'AGE_GROUP': ['18-24', '25-34', '35-44', '45-54', '55-64', '65+'],
+    'GENDER': ['MALE', 'FEMALE', 'OTHER'],
+    'NATIONALITY': ['MALAYSIAN', 'NON-MALAYSIAN', 'OTHER'],
+    'MOBILITY_TYPE': ['HOME', 'WORK', 'PASSERBY'],
+    'DEVICE_BRAND': ['APPLE', 'SAMSUNG', 'HUAWEI', 'XIAOMI', 'OPPO', 'VIVO', 'OTHERS'],
+    'HOME_STATE': ['JOHOR', 'KEDAH', 'KELANTAN', 'MELAKA', 'NEGERI SEMBILAN', 'PAHANG', 'PERAK',
+                   'PERLIS', 'PULAU PINANG', 'SABAH', 'SARAWAK', 'SELANGOR', 'TERENGGANU',
+                   'KUALA LUMPUR', 'LABUAN', 'PUTRAJAYA'],
+    'DAY': ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY'],
+}
+COLUMN_VALUES['WORK_STATE'] = COLUMN_VALUES['HOME_STATE']
+
+# Averages and distances, generated as fractions. The other numeric columns
+# are whole numbers, whatever dtype the ETL reads them as
+FRACTIONAL_COLUMNS = (
+    'DAILY_AVERAGE_IMPRESSIONS', 'DAILY_AVERAGE_USER_REACH', 'AVG_WORK_DISTANCE', 'AVG_HOME_DISTANCE',
+)
+
+# Upper bound (exclusive) of generated whole numbers, per column
+INTEGER_RANGES = {'HOUR': 24}
+DEFAULT_INTEGER_RANGE = 5000
+
+
+def polygon_ids(count: int, rng) -> np.ndarray:
+    """H3-like level 8 cell ids: 15 hex digits."""
+    cells = rng.choice(2 ** 32, size=count, replace=False)
+    return np.array([f"88{cell:08x}fffff" for cell in cells], dtype=object)
+
+
+def date_values(column: str, months: int, start: date) -> np.ndarray:
+    """Month starts for MONTH columns, every day of those months for DATA_DATE."""
+    firsts = [pd.Timestamp(start) + pd.DateOffset(months=offset) for offset in range(months)]
+    if column == 'MONTH':
+        return np.array([first.strftime('%Y-%m-%d') for first in firsts], dtype=object)
+    days = []
+    for first in firsts:
+        day = first.date()
+        while day.month == first.month:
+            days.append(day.strftime('%Y-%m-%d'))
+            day += timedelta(days=1)
+    return np.array(days, dtype=object)
+
+
+def generate_batch(manifest, rows: int, polygons: np.ndarray, months: int, null_rate: float, start: date, rng):
+    """One DataFrame of ``rows`` synthetic rows for the manifest's columns."""
+    columns = {}
+    for column in manifest.columns:
+        if column in manifest.dates:
+            # The ETL rejects rows without a date, so date columns are never null
+            columns[column] = rng.choice(date_values(column, months, start), size=rows)
+            continue
+
+        if column == 'POLYGON_L8':
+            values = pd.Series(rng.choice(polygons, size=rows), dtype=object)
+        elif column in COLUMN_VALUES:
+            values = pd.Series(rng.choice(COLUMN_VALUES[column], size=rows), dtype=object)
+        elif column in FRACTIONAL_COLUMNS:
+            values = pd.Series(np.round(rng.random(rows) * 100, 2))
+        else:
+            values = pd.Series(rng.integers(0, INTEGER_RANGES.get(column, DEFAULT_INTEGER_RANGE), size=rows),
+                               dtype='Int64')
+
+        if null_rate > 0:
+            values[rng.random(rows) < null_rate] = None
+        columns[column] = values.values
+
+    return pd.DataFrame(columns)
+
+
+def generate_file(path: str, manifest, rows: int, polygons: int, null_rate: float = 0.0,
+                  months: int = 1, start: date = date(2024, 5, 1), seed: int = 0) -> int:
+    """Write a CSV of ``rows`` rows to ``path`` and return its size in bytes."""
+    rng = np.random.default_rng(seed)
+    pool = polygon_ids(polygons, rng)
+    with open(path, 'w', newline='') as output:
+        written = 0
+        while True:
+            batch = generate_batch(manifest, min(BATCH_ROWS, rows - written), pool, months, null_rate, start, rng)
+            batch.to_csv(output, header=written == 0, index=False)
+            written += len(batch)
+            if written >= rows:
+                break
+    return os.path.getsize(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output_dir')
+    parser.add_argument('--rows', type=int, default=10_000, help='rows per file (default: 10000)')
+    parser.add_argument('--polygons', type=int, default=10_000, help='distinct POLYGON_L8 values (default: 10000)')
+    parser.add_argument('--null-rate', type=float, default=0.0, help='share of null cells per column (default: 0)')
+    parser.add_argument('--months', type=int, default=1, help='month schemas the rows spread over (default: 1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--datasets', nargs='*', default=list(DATASETS), help='file types to generate (default: all)')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for key in args.datasets:
+        path = os.path.join(args.output_dir, key)
+        size = generate_file(path, DATASETS[key].manifest, args.rows, args.polygons,
+                             args.null_rate, args.months, seed=args.seed)
+        print(f"{key}: {args.rows} rows, {size} bytes")
+
+
+if __name__ == '__main__':
+    main()
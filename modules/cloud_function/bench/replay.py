@@ -0,0 +1,267 @@
+"""Replay recorded finalize events through ``etl`` and profile them offline.
+
+Each line of the events file is a recorded finalize payload (``bucket``,
+``name``, ``size`` and optionally ``generation``, ``md5Hash``...), or a
+CloudEvent carrying it as ``data``. Objects are read from
+``<bucket-dir>/<bucket>/<name>``, the database secrets from a JSON file
+mapping the Secret Manager secret ids to values, and rows are written to
+the (local) Postgres those secrets point at:
+
+    python replay.py events.jsonl --bucket-dir /data/buckets --secrets secrets.json \\
+        --cprofile --tracemalloc --sample 0.005 --output report.json
+
+``--dsn`` takes a libpq connection string instead of ``--secrets``.
+
+The report has the time per stage and counters of every event (from the
+invocation metrics), summed per stage and per ``process_*`` function, and
+for each switch:
+
+- ``--cprofile``: the functions with the most cumulative time. cProfile
+  only sees the thread calling ``etl``; loads in partition writer threads
+  show up in the sampler instead.
+- ``--tracemalloc``: the peak of traced memory per event and the lines
+  holding the most memory at the end.
+- ``--sample SECONDS``: the stacks of every thread sampled at that
+  interval, like py-spy, counted per function on top of the stack (own)
+  and anywhere in it (total). Threads waiting on a lock or queue are left
+  out.
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import metrics  # noqa: E402
+import processing  # noqa: E402
+from main import etl  # noqa: E402
+
+
+# Rows of each ranking in the report
+DEFAULT_TOP = 25
+
+# Functions a thread sits in while it waits, left out of the samples
+IDLE_FUNCTIONS = {'wait', 'acquire', 'get', 'put', 'select', 'sleep', '_wait_for_tstate_lock'}
+
+
+def read_events(path: str):
+    with open(path) as handle:
+        for line in handle:
+            if line.strip():
+                event = json.loads(line)
+                yield event.get('data', event)
+
+
+def describe(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler(threading.Thread):
+    """Counts the functions on the stacks of every other thread at a fixed interval."""
+
+    def __init__(self, interval: float):
+        super().__init__(name='replay-sampler', daemon=True)
+        self.interval = interval
+        self.own = Counter()
+        self.total = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                self.samples += 1
+                self.own[describe(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    name = describe(frame)
+                    if name not in seen:
+                        seen.add(name)
+                        self.total[name] += 1
+                    frame = frame.f_back
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+    def report(self, top: int) -> dict:
+        def ranked(counter):
+            return [
+                {'function': name, 'samples': count, 'seconds': round(count * self.interval, 6)}
+                for name, count in counter.most_common(top)
+            ]
+        return {
+            'interval': self.interval,
+            'samples': self.samples,
+            'own': ranked(self.own),
+            'total': ranked(self.total),
+            'process_functions': ranked(Counter({
+                name: count for name, count in self.total.items() if name.startswith('process_')
+            })),
+        }
+
+
+def cprofile_report(profile: cProfile.Profile, top: int) -> dict:
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    rows = [
+        {
+            'function': f"{name} ({os.path.basename(file)}:{line})",
+            'calls': calls,
+            'own_seconds': round(own, 6),
+            'cumulative_seconds': round(cumulative, 6),
+        }
+        for (file, line, name), (_, calls, own, cumulative, _) in stats.stats.items()
+    ]
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return {
+        'cumulative': rows[:top],
+        'process_functions': [row for row in rows if row['function'].startswith('process_')],
+    }
+
+
+def summarize(records) -> dict:
+    """Sum the stage times and counters of the events, overall and per process_* function."""
+    stages = defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+    counters = Counter()
+    functions = defaultdict(lambda: {'events': 0, 'seconds': 0.0, 'stages': Counter()})
+    for record in records:
+        counters.update(record['counters'])
+        dataset = processing.DATASETS.get(record.get('dataset'))
+        function = functions[dataset.process.__name__] if dataset else None
+        if function is not None:
+            function['events'] += 1
+            function['seconds'] += record['duration_seconds']
+        for name, stage in record['stages'].items():
+            stages[name]['seconds'] += stage['seconds']
+            stages[name]['calls'] += stage['calls']
+            if function is not None:
+                function['stages'][name] += stage['seconds']
+
+    return {
+        'events': len(records),
+        'seconds': sum(record['duration_seconds'] for record in records),
+        'stages': dict(stages),
+        'counters': dict(counters),
+        'process_functions': {
+            name: {**function, 'stages': dict(function['stages'])} for name, function in functions.items()
+        },
+    }
+
+
+def replay(events, cprofile: bool = False, trace_memory: bool = False, sample: float = None,
+           top: int = DEFAULT_TOP) -> dict:
+    """Run every event through ``etl`` and return the report."""
+    records = []
+    metrics.set_exporter(records.append)
+    profile = cProfile.Profile() if cprofile else None
+    sampler = Sampler(sample) if sample else None
+    if trace_memory:
+        tracemalloc.start()
+    if sampler is not None:
+        sampler.start()
+
+    peaks = []
+    started = time.perf_counter()
+    try:
+        for event in events:
+            if profile is not None:
+                profile.enable()
+            try:
+                etl(event, None)
+            finally:
+                if profile is not None:
+                    profile.disable()
+            if trace_memory:
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+            print(f"{event['name']}: {records[-1]['status']} in {records[-1]['duration_seconds']:.3f}s",
+                  file=sys.stderr)
+    finally:
+        metrics.set_exporter(None)
+        if sampler is not None:
+            sampler.stop()
+
+    report = {
+        'wall_seconds': time.perf_counter() - started,
+        'summary': summarize(records),
+        'events': records,
+    }
+    if profile is not None:
+        report['cprofile'] = cprofile_report(profile, top)
+    if sampler is not None:
+        report['sampling'] = sampler.report(top)
+    if trace_memory:
+        for record, peak in zip(records, peaks):
+            record['traced_peak_bytes'] = peak
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        report['tracemalloc'] = [
+            {'line': str(statistic.traceback), 'bytes': statistic.size, 'blocks': statistic.count}
+            for statistic in snapshot.statistics('lineno')[:top]
+        ]
+    return report
+
+
+def print_summary(report: dict) -> None:
+    summary = report['summary']
+    print(f"Replayed {summary['events']} events in {report['wall_seconds']:.1f}s", file=sys.stderr)
+    for name, stage in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"  {name}: {stage['seconds']:.3f}s over {stage['calls']} calls", file=sys.stderr)
+    for name, function in sorted(summary['process_functions'].items()):
+        print(f"  {name}: {function['events']} events, {function['seconds']:.3f}s", file=sys.stderr)
+    for row in report.get('sampling', {}).get('own', [])[:10]:
+        print(f"  sampled {row['function']}: {row['seconds']:.3f}s", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('events', help='recorded finalize events, one JSON object per line')
+    parser.add_argument('--bucket-dir', required=True, help='directory holding <bucket>/<name> of each object')
+    parser.add_argument('--secrets', help='JSON file of Secret Manager secret ids to values')
+    parser.add_argument('--dsn', help='libpq connection string, instead of --secrets')
+    parser.add_argument('--manifest', action='store_true',
+                        help='keep the load manifest on, so events already loaded are skipped')
+    parser.add_argument('--cprofile', action='store_true', help='profile the entry point with cProfile')
+    parser.add_argument('--tracemalloc', action='store_true', help='trace memory allocations')
+    parser.add_argument('--sample', type=float, metavar='SECONDS', help='sample every thread at this interval')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='rows of each ranking')
+    parser.add_argument('--output', help='write the report as JSON to this file (default: stdout)')
+    args = parser.parse_args(argv)
+    if not args.secrets and not args.dsn:
+        parser.error('--secrets or --dsn is required')
+
+    os.environ['ETL_LOCAL_BUCKET_DIR'] = os.path.abspath(args.bucket_dir)
+    if args.secrets:
+        os.environ['ETL_SECRETS_FILE'] = os.path.abspath(args.secrets)
+    if args.dsn:
+        os.environ['ETL_DATABASE_DSN'] = args.dsn
+    if not args.manifest:
+        # A replay loads the same objects again, which the manifest would skip
+        os.environ['ETL_LOAD_MANIFEST'] = '0'
+
+    report = replay(read_events(args.events), args.cprofile, args.tracemalloc, args.sample, args.top)
+    print_summary(report)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+    return 1 if any(record['status'] == 'error' for record in report['events']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
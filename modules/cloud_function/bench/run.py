@@ -0,0 +1,234 @@
+"""Time and memory-profile each ETL stage over a directory of generated files.
+
+The directory stands in for the trigger bucket and the database is a local
+Postgres given as a libpq connection string; ``schema.sql`` creates a
+stand-in ``create_schema_and_tables`` for an empty database.
+
+    python run.py DATA_DIR --dsn "host=localhost dbname=bench user=postgres" \\
+        --output results.json --baseline previous.json
+
+Stages, per file: ``extract`` (download the object), ``read_csv`` (parse
+it with the dataset's manifest), ``transform`` (``stream_table_loads``:
+parsing, the ``process_*`` function, dropping duplicate keys and, in delta
+mode, fingerprints), ``build`` (serialise the COPY batches and upsert
+statements as the loader does) and ``load`` (COPY and upsert into
+Postgres), plus ``etl`` for the whole entry point. ``etl`` runs with the
+environment's settings, so it takes the production path unless told
+otherwise; the event carries a ``generation``, so ``--checkpoints`` (or
+``ETL_CHECKPOINTS=1``) times the checkpointed path instead.
+
+The month schemas of the file are dropped before each ``load`` and ``etl``
+run, so every run inserts every row into freshly created tables. A run
+that affects no rows fails the benchmark. With ``--repeat``, the median run
+of each stage is kept. With ``--baseline``, stages slower than the baseline
+by more than ``--threshold`` are reported and the exit status is 1.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import metrics  # noqa: E402
+from main import etl  # noqa: E402
+from processing import DATASETS, stream_table_loads  # noqa: E402
+from clients import database_connection  # noqa: E402
+from extract import open_object, read_csv_chunks  # noqa: E402
+from loader import csv_batches, forget_schema, load_partitions, upsert_statement  # noqa: E402
+
+
+# Relative slowdown of a stage reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+
+@contextmanager
+def stage(results: dict, name: str, memory: bool):
+    """Record the wall time, and with ``memory`` the traced peak, of the block."""
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        yield results.setdefault(name, {})
+    finally:
+        results[name]['seconds'] = time.perf_counter() - started
+        if memory:
+            results[name]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def build(table_loads, cursor) -> int:
+    """Serialise every load the way the loader does, without sending it."""
+    size = 0
+    for table_load in table_loads:
+        for _, buffer in csv_batches(table_load):
+            size += len(buffer.getbuffer()) if isinstance(buffer, io.BytesIO) else len(buffer.getvalue())
+        upsert_statement(table_load).as_string(cursor)
+    return size
+
+
+def reset_schemas(schemas) -> None:
+    """Drop the month schemas, so the next run creates and fills them from scratch."""
+    with database_connection() as conn:
+        with conn.cursor() as cursor:
+            for schema in schemas:
+                cursor.execute(sql.SQL('DROP SCHEMA IF EXISTS {} CASCADE').format(sql.Identifier(schema)))
+        conn.commit()
+    for schema in schemas:
+        forget_schema(schema)
+
+
+def run_etl(event: dict) -> dict:
+    """Run the entry point and return its metrics record."""
+    records = []
+    metrics.set_exporter(records.append)
+    try:
+        etl(event, None)
+    finally:
+        metrics.set_exporter(None)
+    return records[0]
+
+
+def run_file(bucket: str, key: str, memory: bool) -> dict:
+    dataset = DATASETS[key]
+    results = {}
+
+    with stage(results, 'extract', memory) as record:
+        with open_object(bucket, key) as reader:
+            payload = reader.read()
+        record['bytes'] = len(payload)
+
+    with stage(results, 'read_csv', memory) as record:
+        chunks = list(read_csv_chunks(io.BytesIO(payload), manifest=dataset.manifest, file_name=key))
+        if dataset.whole_file:
+            chunks = [pd.concat(chunks, ignore_index=True)]
+        record['rows'] = sum(len(chunk) for chunk in chunks)
+        record['chunks'] = len(chunks)
+
+    del chunks
+
+    with stage(results, 'transform', memory) as record:
+        table_loads = list(stream_table_loads(io.BytesIO(payload), key))
+        record['function'] = dataset.process.__name__
+        record['rows'] = sum(len(table_load.frame) for table_load in table_loads)
+        record['rows_dropped'] = results['read_csv']['rows'] - record['rows']
+    schemas = sorted({table_load.schema for table_load in table_loads})
+
+    with database_connection() as conn:
+        with conn.cursor() as cursor:
+            with stage(results, 'build', memory) as record:
+                record['bytes'] = build(table_loads, cursor)
+
+    reset_schemas(schemas)
+    with stage(results, 'load', False) as record:
+        record['rows'], record['rows_affected'] = load_partitions(table_loads, connect=database_connection)
+    if not record['rows_affected']:
+        raise RuntimeError(f"{key}: the load affected no rows")
+
+    reset_schemas(schemas)
+    event = {
+        'bucket': bucket,
+        'name': key,
+        'size': results['extract']['bytes'],
+        'generation': str(os.stat(os.path.join(os.environ['ETL_LOCAL_BUCKET_DIR'], bucket, key)).st_mtime_ns),
+    }
+    with stage(results, 'etl', False) as record:
+        etl_record = run_etl(event)
+    record['rows_affected'] = etl_record['counters'].get('rows_upserted', 0)
+    if etl_record['status'] != 'ok' or not record['rows_affected']:
+        raise RuntimeError(f"{key}: the etl run affected no rows ({etl_record.get('error', etl_record['status'])})")
+
+    return results
+
+
+def median_of(runs):
+    """Keep the median run of each stage (the lower one of an even number of runs)."""
+    return {
+        name: sorted((run[name] for run in runs), key=lambda record: record['seconds'])[(len(runs) - 1) // 2]
+        for name in runs[0]
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Yield ``(file, stage, baseline seconds, seconds)`` of each stage that got slower."""
+    for key, stages in results['files'].items():
+        for name, record in stages.items():
+            before = baseline.get('files', {}).get(key, {}).get(name)
+            if before and record['seconds'] > before['seconds'] * (1 + threshold):
+                yield key, name, before['seconds'], record['seconds']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir')
+    parser.add_argument('--dsn', default=os.getenv('ETL_DATABASE_DSN'), help='libpq connection string')
+    parser.add_argument('--output', help='write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per file; the median is kept')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace peak allocations per stage (slows the traced stages down)')
+    parser.add_argument('--datasets', nargs='*', default=None, help='file types to run (default: all present)')
+    parser.add_argument('--checkpoints', action='store_true',
+                        help='load chunk by chunk with checkpoints, as ETL_CHECKPOINTS=1 does')
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error('--dsn or ETL_DATABASE_DSN is required')
+
+    data_dir = os.path.abspath(args.data_dir)
+    os.environ['ETL_DATABASE_DSN'] = args.dsn
+    os.environ['ETL_LOCAL_BUCKET_DIR'] = os.path.dirname(data_dir)
+    # Every repeat loads the same objects again, which the manifest would skip
+    os.environ['ETL_LOAD_MANIFEST'] = '0'
+    if args.checkpoints:
+        os.environ['ETL_CHECKPOINTS'] = '1'
+    bucket = os.path.basename(data_dir)
+
+    keys = args.datasets or [key for key in DATASETS if os.path.exists(os.path.join(data_dir, key))]
+    results = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'chunk_rows': os.getenv('ETL_CHUNK_ROWS'),
+            'checkpoints': os.getenv('ETL_CHECKPOINTS', '0'),
+            'repeat': args.repeat,
+            'memory': args.memory,
+        },
+        'files': {},
+    }
+    for key in keys:
+        results['files'][key] = median_of([run_file(bucket, key, args.memory) for _ in range(args.repeat)])
+        print(f"{key}: " + ', '.join(
+            f"{name} {record['seconds']:.3f}s" for name, record in results['files'][key].items()
+        ), file=sys.stderr)
+    results['meta']['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = list(compare(results, json.load(handle), args.threshold))
+        for key, name, before, after in regressions:
+            print(f"REGRESSION {key} {name}: {before:.3f}s -> {after:.3f}s", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+-- Stand-in for the create_schema_and_tables() function of the dashboard
+-- database, for running the benchmark against an empty local Postgres:
+--     psql "$ETL_DATABASE_DSN" -f schema.sql
+-- For integer polygon keys (ETL_POLYGON_ENCODING=h3), have new months
+-- created with bigint polygon columns:
+--     ALTER DATABASE bench SET bench.polygon_type = 'bigint';
+CREATE OR REPLACE FUNCTION create_schema_and_tables(s text) RETURNS void AS $$
+DECLARE
+  p text := coalesce(nullif(current_setting('bench.polygon_type', true), ''), 'varchar(20)');
+BEGIN
+  EXECUTE format('CREATE SCHEMA IF NOT EXISTS %I', s);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.age_wise_user_reaches (id serial, date date, polygon %2$s, age_group varchar(20), user_reach int, UNIQUE(polygon, age_group))', s, p);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.monthly_overviews (id serial, date date, polygon %2$s UNIQUE, impressions bigint, user_reach bigint, daily_average_impressions double precision, daily_average_user_reach double precision, weekdays_impressions bigint, weekdays_user_reach bigint, weekends_impressions double precision, weekends_user_reach bigint)', s, p);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.device_types (id serial, date date, polygon %2$s, device_brand varchar(50), user_reach int, UNIQUE(polygon, device_brand))', s, p);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.gender_nationality_user_reaches (id serial, date date, polygon %2$s UNIQUE, gender_male_reaches int default 0, gender_female_reaches int default 0, gender_other_reaches int default 0, nationality_malaysian_reaches int default 0, nationality_non_malaysian_reaches int default 0, nationality_other_reaches int default 0)', s, p);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.mobility_type_wise_user_reaches (id serial, date date, polygon %2$s UNIQUE, home_user_reach int default 0, work_user_reach int default 0, passerby_user_reach int default 0, avg_work_distance double precision, avg_home_distance double precision)', s, p);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.mobility_state_wise_user_reaches (id serial, date date, polygon %2$s, mobility_type varchar(10), user_reach int, state varchar(50), UNIQUE(polygon, mobility_type, state))', s, p);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.hourly_trends (id serial, date date, polygon %2$s, weekday varchar(10), hour int, impressions int, user_reach int, daily_average_impressions double precision, daily_average_user_reach int, UNIQUE(polygon, weekday, hour))', s, p);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %1$I.daily_trends (id serial, date date, polygon %2$s, weekday varchar(10), impressions int, user_reach int, UNIQUE(polygon, date))', s, p);
+END $$ LANGUAGE plpgsql;
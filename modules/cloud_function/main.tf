@@ -45,15 +45,16 @@ resource "google_cloudfunctions2_function" "function" {
   }
 
   service_config {
-    max_instance_count = 1
-    min_instance_count = 0
-    available_memory   = "8G"
-    available_cpu      = 4
-    timeout_seconds    = 1800
-    environment_variables = {
+    max_instance_count               = 1
+    min_instance_count               = 0
+    max_instance_request_concurrency = var.max_instance_request_concurrency
+    available_memory                 = "8G"
+    available_cpu                    = 4
+    timeout_seconds                  = 1800
+    environment_variables = merge({
       PROJECT_ID  = var.project_id
       ENVIRONMENT = var.environment
-    }
+    }, var.etl_environment_variables)
     ingress_settings               = "ALLOW_INTERNAL_ONLY"
     all_traffic_on_latest_revision = true
     service_account_email          = var.service_account_email
@@ -0,0 +1,180 @@
+"""Backfill: load every object under a bucket prefix or in a local directory.
+
+Rebuilding a database or reprocessing history through the trigger means
+re-uploading objects one by one. This runs the same transforms and loader
+over many objects at once, in a pool of worker processes:
+
+    python backfill.py gs://bucket/2024/ --workers 8 --per-table 2 --months 2024_05 2024_06
+    python backfill.py /data/exports --workers 4
+
+Objects writing the same table are limited to ``--per-table`` at a time,
+because concurrent upserts of the same rows in different orders deadlock.
+The database is the one the function uses (Secret Manager, or
+``ETL_DATABASE_DSN``).
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from clients import database_connection, get_storage_client
+from datasets import dataset_key
+from extract import decompressed, open_object
+from loader import load_partitions
+from processing import DATASETS, find_dataset, stream_table_loads
+
+
+DEFAULT_WORKERS = 4
+
+# Objects loaded into the same table at the same time
+DEFAULT_PER_TABLE = 1
+
+_table_slots = {}
+
+
+def list_objects(source: str):
+    """Return ``(location, [(name, size)])`` of the dataset objects under ``source``."""
+    if source.startswith('gs://'):
+        bucket, _, prefix = source[len('gs://'):].partition('/')
+        objects = [(blob.name, blob.size or 0) for blob in get_storage_client().list_blobs(bucket, prefix=prefix)]
+    else:
+        bucket = os.path.abspath(source)
+        objects = []
+        for directory, _, files in os.walk(bucket):
+            for file in files:
+                path = os.path.join(directory, file)
+                objects.append((os.path.relpath(path, bucket), os.path.getsize(path)))
+
+    location = source if source.startswith('gs://') else bucket
+    return location, sorted(obj for obj in objects if dataset_key(obj[0]) is not None)
+
+
+@contextmanager
+def open_location(location: str, name: str):
+    if location.startswith('gs://'):
+        bucket = location[len('gs://'):].partition('/')[0]
+        with open_object(bucket, name) as reader:
+            yield reader
+    else:
+        with open(os.path.join(location, name), 'rb') as reader:
+            yield reader
+
+
+def init_worker(table_slots: dict) -> None:
+    _table_slots.update(table_slots)
+
+
+def load_object(location: str, name: str, months=()) -> dict:
+    """Transform and load one object in a worker process."""
+    started = time.perf_counter()
+    dataset = find_dataset(name)
+    with open_location(location, name) as raw_reader:
+        table_loads = stream_table_loads(decompressed(raw_reader, name), name)
+        if months:
+            table_loads = (table_load for table_load in table_loads if table_load.schema in months)
+
+        slot = _table_slots.get(dataset.table)
+        if slot is not None:
+            slot.acquire()
+        try:
+            rows_loaded, rows_affected = load_partitions(table_loads, connect=database_connection)
+        finally:
+            if slot is not None:
+                slot.release()
+
+    return {
+        'name': name,
+        'table': dataset.table,
+        'rows_loaded': rows_loaded,
+        'rows_affected': rows_affected,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def backfill(source: str, workers: int = DEFAULT_WORKERS, per_table: int = DEFAULT_PER_TABLE, months=()) -> dict:
+    """Load every dataset object under ``source`` and return the throughput summary."""
+    location, objects = list_objects(source)
+    sizes = dict(objects)
+
+    # Spawned workers start clean, without the parent's connections or threads
+    context = multiprocessing.get_context('spawn')
+    tables = {dataset.table for dataset in DATASETS.values()}
+    table_slots = {table: context.BoundedSemaphore(per_table) for table in tables}
+
+    started = time.perf_counter()
+    results, failures = [], {}
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker,
+                             initargs=(table_slots,)) as executor:
+        futures = {executor.submit(load_object, location, name, tuple(months)): name for name, _ in objects}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures[name] = str(e)
+                print(f"FAILED {name}: {e}", file=sys.stderr)
+                continue
+            results.append(result)
+            print(f"{name}: {result['rows_loaded']} rows in {result['seconds']:.1f}s", file=sys.stderr)
+
+    return summarize(results, failures, sizes, time.perf_counter() - started)
+
+
+def summarize(results, failures: dict, sizes: dict, seconds: float) -> dict:
+    per_table = defaultdict(lambda: {'objects': 0, 'rows_loaded': 0, 'seconds': 0.0})
+    for result in results:
+        table = per_table[result['table']]
+        table['objects'] += 1
+        table['rows_loaded'] += result['rows_loaded']
+        table['seconds'] += result['seconds']
+
+    rows = sum(result['rows_loaded'] for result in results)
+    size = sum(sizes[result['name']] for result in results)
+    return {
+        'objects': len(results),
+        'failed': failures,
+        'rows_loaded': rows,
+        'rows_affected': sum(result['rows_affected'] for result in results),
+        'bytes': size,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds else 0.0,
+        'megabytes_per_second': size / seconds / 1e6 if seconds else 0.0,
+        'tables': dict(per_table),
+    }
+
+
+def print_summary(summary: dict) -> None:
+    print(
+        f"Loaded {summary['objects']} objects, {summary['rows_loaded']} rows "
+        f"({summary['bytes'] / 1e6:.1f} MB) in {summary['seconds']:.1f}s: "
+        f"{summary['rows_per_second']:.0f} rows/s, {summary['megabytes_per_second']:.2f} MB/s"
+    )
+    for table, stats in sorted(summary['tables'].items()):
+        print(f"  {table}: {stats['objects']} objects, {stats['rows_loaded']} rows, {stats['seconds']:.1f}s")
+    if summary['failed']:
+        print(f"{len(summary['failed'])} objects failed:")
+        for name, error in sorted(summary['failed'].items()):
+            print(f"  {name}: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='gs://bucket/prefix or a local directory')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='worker processes')
+    parser.add_argument('--per-table', type=int, default=DEFAULT_PER_TABLE,
+                        help='objects loaded into the same table at a time')
+    parser.add_argument('--months', nargs='*', default=(),
+                        help='only load rows of these month schemas, e.g. 2024_05')
+    args = parser.parse_args(argv)
+
+    summary = backfill(args.source, args.workers, args.per_table, args.months)
+    print_summary(summary)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
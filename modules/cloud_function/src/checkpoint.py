@@ -0,0 +1,61 @@
+"""Load checkpoints: how far into an object version the committed chunks reach.
+
+A file that outlives the function timeout is redelivered and would otherwise
+be loaded again from its first byte. In checkpointed mode every chunk is
+committed on its own and the byte offset just past it is saved, so the retry
+seeks past the chunks that are already in the database.
+"""
+import os
+
+from clients import ensure_table_once
+from manifest import ObjectIdentity
+
+
+CHECKPOINT_TABLE = 'etl_load_checkpoint'
+
+
+def checkpoints_enabled() -> bool:
+    return os.getenv('ETL_CHECKPOINTS', '0').lower() in ('1', 'true', 'yes')
+
+
+def ensure_checkpoint_table(cursor) -> None:
+    ensure_table_once(cursor, CHECKPOINT_TABLE, CHECKPOINT_TABLE, f"""
+        CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+            bucket text NOT NULL,
+            object_name text NOT NULL,
+            generation text NOT NULL,
+            byte_offset bigint NOT NULL,
+            rows_committed bigint NOT NULL,
+            updated_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (bucket, object_name, generation)
+        )
+    """, lock=(CHECKPOINT_TABLE,))
+
+
+def read_checkpoint(cursor, identity: ObjectIdentity):
+    """Return ``(byte_offset, rows_committed)`` of this object version, ``(0, 0)`` if none."""
+    ensure_checkpoint_table(cursor)
+    cursor.execute(f"""
+        SELECT byte_offset, rows_committed FROM {CHECKPOINT_TABLE}
+        WHERE bucket = %s AND object_name = %s AND generation = %s
+    """, (identity.bucket, identity.name, identity.generation))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def save_checkpoint(cursor, identity: ObjectIdentity, byte_offset: int, rows_committed: int) -> None:
+    ensure_checkpoint_table(cursor)
+    cursor.execute(f"""
+        INSERT INTO {CHECKPOINT_TABLE} (bucket, object_name, generation, byte_offset, rows_committed)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (bucket, object_name, generation) DO UPDATE
+        SET byte_offset = EXCLUDED.byte_offset, rows_committed = EXCLUDED.rows_committed, updated_at = now()
+    """, (identity.bucket, identity.name, identity.generation, byte_offset, rows_committed))
+
+
+def clear_checkpoint(cursor, identity: ObjectIdentity) -> None:
+    ensure_checkpoint_table(cursor)
+    cursor.execute(f"""
+        DELETE FROM {CHECKPOINT_TABLE}
+        WHERE bucket = %s AND object_name = %s AND generation = %s
+    """, (identity.bucket, identity.name, identity.generation))
@@ -0,0 +1,368 @@
+"""Process-wide clients, built once per instance and reused across invocations.
+
+A warm Cloud Functions instance handles many events; creating the storage and
+Secret Manager clients and opening a Postgres connection for every file
+repeats the same auth and TLS handshakes each time.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from main import log_message
+import metrics
+
+
+# Upper bound of pooled Postgres connections kept open by one instance
+DEFAULT_DB_POOL_SIZE = 4
+
+# Seconds the database secrets are served from memory before a background refresh;
+# the connection pool is replaced once a refresh returns different settings
+DEFAULT_SECRET_TTL_SECONDS = 600
+
+# Connection settings and the Secret Manager secrets they are read from
+DATABASE_SECRETS = {
+    'dbname': 'MDI_DASHBOARD_DB_NAME',
+    'user': 'MDI_DB_USER',
+    'password': 'MDI_DB_PASSWORD',
+    'host': 'MDI_DB_HOST',
+    'port': 'MDI_DB_PORT',
+}
+
+_lock = threading.Lock()
+_storage_client = None
+_secret_client = None
+_connection_pool = None
+
+
+def get_storage_client():
+    global _storage_client
+    if _storage_client is None:
+        with _lock:
+            if _storage_client is None:
+                # Imported on first use: local runs and ETL_DATABASE_DSN never load them
+                from google.cloud import storage
+                _storage_client = storage.Client()
+    return _storage_client
+
+
+def get_secret_client():
+    global _secret_client
+    if _secret_client is None:
+        with _lock:
+            if _secret_client is None:
+                from google.cloud import secretmanager
+                _secret_client = secretmanager.SecretManagerServiceClient()
+    return _secret_client
+
+
+def access_secret_version(secret_id: str):
+    # Local runs and replays read the secrets from a JSON file of secret id to value
+    secrets_file = os.getenv('ETL_SECRETS_FILE')
+    if secrets_file:
+        with open(secrets_file) as handle:
+            return str(json.load(handle)[secret_id])
+
+    # Define the project ID and secret ID
+    project_id = os.getenv('PROJECT_ID')
+    secret_version_id = "latest"    # Replace with the version of the secret, e.g., "latest" or "versions/1"
+
+    # Build the resource name of the secret version
+    secret_version_name = f"projects/{project_id}/secrets/{secret_id}/versions/{secret_version_id}"
+
+    # Access the secret version
+    response = get_secret_client().access_secret_version(name=secret_version_name)
+
+    # Get the secret payload
+    secret_payload = response.payload.data.decode("utf-8")
+
+    return secret_payload
+
+
+class SecretCache:
+    """In-memory cache of a fixed set of secrets.
+
+    The first ``get`` fetches every secret concurrently and blocks; after
+    ``ttl`` seconds the cached values keep being served while one background
+    thread refreshes them. ``invalidate`` forces the next ``get`` to fetch
+    again, e.g. after the database rejected a rotated password.
+    """
+
+    def __init__(self, secrets: dict, ttl: float = None):
+        self.secrets = secrets
+        self.ttl = ttl
+        self._values = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _ttl(self) -> float:
+        if self.ttl is not None:
+            return self.ttl
+        return float(os.getenv('ETL_SECRET_TTL_SECONDS', DEFAULT_SECRET_TTL_SECONDS))
+
+    def _fetch(self) -> dict:
+        with ThreadPoolExecutor(max_workers=len(self.secrets)) as executor:
+            futures = {
+                key: executor.submit(access_secret_version, secret_id)
+                for key, secret_id in self.secrets.items()
+            }
+            return {key: future.result() for key, future in futures.items()}
+
+    def _refresh(self) -> None:
+        try:
+            values = self._fetch()
+            with self._lock:
+                self._values = values
+                self._fetched_at = time.monotonic()
+        except Exception as e:
+            # The cached values keep being served; the next stale get tries again
+            log_message(f"Refreshing the database secrets failed: {e}", 'WARNING')
+        finally:
+            self._refreshing = False
+
+    def get(self) -> dict:
+        with self._lock:
+            values = self._values
+            stale = time.monotonic() - self._fetched_at > self._ttl()
+            if values is not None and stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+
+        if values is None:
+            values = self._fetch()
+            with self._lock:
+                self._values = values
+                self._fetched_at = time.monotonic()
+        return dict(values)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._values = None
+            self._fetched_at = 0.0
+
+
+database_secrets = SecretCache(DATABASE_SECRETS)
+
+
+def database_settings() -> dict:
+    # A local database (benchmarks, replays) is given as a libpq connection string
+    dsn = os.getenv('ETL_DATABASE_DSN')
+    if dsn:
+        return psycopg2.extensions.parse_dsn(dsn)
+
+    # Get the database connection details from Secret Manager, through the cache
+    return database_secrets.get()
+
+
+def is_authentication_failure(error) -> bool:
+    # Connection errors carry no SQLSTATE, so match the server message as well
+    message = str(error).lower()
+    return getattr(error, 'pgcode', None) in ('28P01', '28000') or 'authentication failed' in message
+
+
+class MeteredCursor(psycopg2.extensions.cursor):
+    """Cursor counting its round trips to the server in the invocation metrics."""
+
+    def execute(self, query, vars=None):
+        metrics.increment('db_round_trips')
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        metrics.increment('db_round_trips')
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        metrics.increment('db_round_trips')
+        return super().copy_expert(sql, file, size)
+
+
+class ConnectionPool(pool.ThreadedConnectionPool):
+    """Thread-safe pool that can be retired while its connections are in use.
+
+    ``slots`` holds one permit per connection: psycopg2 raises when the pool
+    is exhausted, callers wait for a slot instead.
+    """
+
+    def __init__(self, minconn, maxconn, settings: dict, **kwargs):
+        super().__init__(minconn, maxconn, **{**kwargs, **settings})
+        # Database settings the connections are opened with
+        self.settings = settings
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.retired = False
+
+    def retire(self) -> None:
+        """Close the idle connections now and the checked-out ones as they are given back."""
+        with self._lock:
+            self.retired = True
+            for conn in self._pool:
+                conn.close()
+            self._pool = []
+
+    def _putconn(self, conn, key=None, close=False):
+        super()._putconn(conn, key, close or self.retired)
+
+
+def get_connection_pool():
+    """The instance's pool, replaced when the database settings changed since it was built.
+
+    Refreshed secrets (a rotated password, a moved host) are picked up by the
+    next checkout; the previous pool is retired.
+    """
+    global _connection_pool
+    connection_pool = _connection_pool
+    if connection_pool is not None and connection_pool.settings == database_settings():
+        return connection_pool
+
+    with _lock:
+        # Read again under the lock, so a thread holding older settings cannot swap them back
+        settings = database_settings()
+        retired = None
+        if _connection_pool is None or _connection_pool.settings != settings:
+            size = int(os.getenv('ETL_DB_POOL_SIZE', DEFAULT_DB_POOL_SIZE))
+            # A sharded load holds a connection per shard plus one for DDL
+            size = max(size, int(os.getenv('ETL_LOAD_SHARDS', '1')) + 1)
+            retired, _connection_pool = _connection_pool, ConnectionPool(
+                1, size, settings,
+                keepalives=1, keepalives_idle=30,
+                cursor_factory=MeteredCursor,
+            )
+        connection_pool = _connection_pool
+    if retired is not None:
+        log_message("Database settings changed; connecting with the new ones.")
+        retired.retire()
+    return connection_pool
+
+
+def reset_connection_pool() -> None:
+    """Swap in a new pool on the next checkout and retire the current one.
+
+    Connections other threads have checked out keep working until they are
+    given back, and are closed then.
+    """
+    global _connection_pool
+    with _lock:
+        retired, _connection_pool = _connection_pool, None
+    if retired is not None:
+        retired.retire()
+
+
+def is_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def checkout_connection():
+    """Take a live connection from the pool, replacing dead ones.
+
+    Returns the pool together with the connection, which must be given back
+    to that same pool.
+
+    An authentication failure drops the cached secrets and the pool once, so a
+    rotated password is picked up without redeploying.
+    """
+    try:
+        return _checkout_connection()
+    except psycopg2.OperationalError as e:
+        if not is_authentication_failure(e):
+            raise
+        database_secrets.invalidate()
+        reset_connection_pool()
+        return _checkout_connection()
+
+
+def _checkout_connection():
+    connection_pool = get_connection_pool()
+    connection_pool.slots.acquire()
+    try:
+        for _ in range(connection_pool.maxconn + 1):
+            conn = connection_pool.getconn()
+            if is_alive(conn):
+                return connection_pool, conn
+            connection_pool.putconn(conn, close=True)
+    except BaseException:
+        connection_pool.slots.release()
+        raise
+
+    connection_pool.slots.release()
+    raise psycopg2.OperationalError("Could not get a live database connection from the pool")
+
+
+@contextmanager
+def database_connection():
+    """Borrow a pooled connection for the duration of the block.
+
+    A connection that failed at the server or network level is closed instead
+    of being returned to the pool.
+    """
+    connection_pool, conn = checkout_connection()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        try:
+            if not broken and not conn.closed:
+                conn.rollback()
+            # A pool retired while the connection was in use closes it
+            connection_pool.putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            connection_pool.slots.release()
+
+
+_tables_ready = set()
+_tables_lock = threading.Lock()
+# Connection that last ran the CREATE of each table, whose transaction may not have committed
+_table_creators = {}
+
+
+def ensure_table_once(cursor, key, table: str, create, lock=()) -> None:
+    """Run ``create`` unless ``table`` exists; once it is committed, skip the check.
+
+    ``key`` names the table in the instance's cache and ``table`` is its
+    qualified name. ``create`` is a statement or a function of the cursor.
+    Creators take turns under the advisory lock of the ``lock`` texts; with
+    none, the caller already holds a lock.
+    """
+    if key in _tables_ready:
+        return
+    # Tables of other open transactions are invisible, and an ended
+    # transaction of this connection committed or dropped its table
+    committed = (_table_creators.get(key) is not cursor.connection
+                 or cursor.connection.get_transaction_status() == TRANSACTION_STATUS_IDLE)
+    cursor.execute('SELECT to_regclass(%s)', (table,))
+    if cursor.fetchone()[0] is not None:
+        if committed:
+            with _tables_lock:
+                _tables_ready.add(key)
+        return
+    if lock:
+        # Concurrent CREATE TABLE IF NOT EXISTS calls can collide, so creators take turns
+        cursor.execute(f"SELECT pg_advisory_xact_lock({', '.join(['hashtext(%s)'] * len(lock))})", tuple(lock))
+    if callable(create):
+        create(cursor)
+    else:
+        cursor.execute(create)
+    with _tables_lock:
+        _table_creators[key] = cursor.connection
+
+
+def forget_table(key) -> None:
+    """The table was dropped; check for it again on the next ``ensure_table_once``."""
+    with _tables_lock:
+        _tables_ready.discard(key)
@@ -0,0 +1,151 @@
+"""Coalescing of sibling files that upsert different columns of the same table.
+
+GENDER_MONTHLY and NATIONALITY_MONTHLY both write ``gender_nationality_user_reaches``;
+MOBILITY_TYPE_MONTHLY and the two average distance files all write
+``mobility_type_wise_user_reaches``. When several of them for the same month
+are handled by one instance within the coalescing window, their rows are
+merged by polygon and every polygon is upserted once instead of once per file.
+Files of the same type within one batch, such as a corrected re-send, are
+combined first, the later file's row winning for a polygon in both.
+"""
+import dataclasses
+import os
+import threading
+import time
+
+import pandas as pd
+
+from loader import TableLoad
+
+
+def coalesce_window() -> float:
+    return float(os.getenv('ETL_COALESCE_WINDOW_SECONDS', '0'))
+
+
+def merge_sibling_loads(table_loads):
+    """Merge TableLoads of one (schema, table) into one load per column set.
+
+    Each polygon gets the columns of every file it appears in, so polygons
+    present in all files end up in a single load. Polygons missing from some
+    files are loaded separately with only the columns they have, which keeps
+    the other files' columns untouched on conflict and at their defaults on
+    insert.
+    """
+    first = table_loads[0]
+    frames = [table_load.frame.set_index('polygon') for table_load in table_loads]
+    index = frames[0].index
+    for frame in frames[1:]:
+        index = index.union(frame.index, sort=False)
+
+    dates = pd.concat([frame['date'].reindex(index) for frame in frames], axis=1).bfill(axis=1).iloc[:, 0]
+    merged = pd.DataFrame({'date': dates.values, 'polygon': index.values})
+    sources = pd.Series(0, index=index)
+    for bit, (table_load, frame) in enumerate(zip(table_loads, frames)):
+        for column in table_load.update_columns:
+            merged[column] = frame[column].reindex(index).values
+        sources = sources + (index.isin(frame.index).astype(int) << bit)
+
+    loads = []
+    for mask, rows in merged.groupby(sources.values, sort=False):
+        members = [table_load for bit, table_load in enumerate(table_loads) if mask & (1 << bit)]
+        update_columns = tuple(column for table_load in members for column in table_load.update_columns)
+        loads.append(TableLoad(
+            schema=first.schema,
+            table=first.table,
+            frame=rows[['date', 'polygon', *update_columns]].reset_index(drop=True),
+            conflict_columns=first.conflict_columns,
+            update_columns=update_columns,
+        ))
+    return loads
+
+
+def combine_resent_loads(members):
+    """One TableLoad per source from ``(source, table_load)`` pairs in arrival order.
+
+    Rows of later loads of a source replace rows of earlier ones with the
+    same conflict key.
+    """
+    by_source = {}
+    for source, table_load in members:
+        by_source.setdefault(source, []).append(table_load)
+
+    loads = []
+    for same in by_source.values():
+        latest = same[-1]
+        if len(same) > 1:
+            frame = pd.concat([table_load.frame for table_load in same], ignore_index=True)
+            frame = frame.drop_duplicates(list(latest.conflict_columns), keep='last').reset_index(drop=True)
+            latest = dataclasses.replace(latest, frame=frame)
+        loads.append(latest)
+    return loads
+
+
+class _Batch:
+    """Loads of one (schema, table) waiting for their siblings."""
+
+    def __init__(self, expected: int, window: float):
+        self.expected = expected
+        self.deadline = time.monotonic() + window
+        # (source, table_load) pairs in arrival order; a source can arrive more than once
+        self.members = []
+        self.complete = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer:
+    """Collects sibling TableLoads per (schema, table) and writes them together.
+
+    The first file of a batch leads it: it waits until every expected sibling
+    has arrived or the window has elapsed, then loads the merged rows. The
+    other files block until that load finished and share its result, so no
+    invocation returns before its rows are committed.
+    """
+
+    def __init__(self, load, siblings: dict, window: float = None):
+        self.load = load
+        self.siblings = siblings
+        self.window = window
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def applies_to(self, table: str) -> bool:
+        return self.siblings.get(table, 0) > 1
+
+    def submit(self, source: str, table_loads):
+        """Add the loads of one file and return ``(rows_loaded, rows_affected)``."""
+        window = coalesce_window() if self.window is None else self.window
+        led, joined = [], []
+        with self._lock:
+            for table_load in table_loads:
+                key = (table_load.schema, table_load.table)
+                batch = self._batches.get(key)
+                if batch is None:
+                    batch = self._batches[key] = _Batch(self.siblings.get(table_load.table, 1), window)
+                    led.append((key, batch))
+                else:
+                    joined.append(batch)
+                batch.members.append((source, table_load))
+                if len({member for member, _ in batch.members}) >= batch.expected:
+                    batch.complete.set()
+
+        for key, batch in led:
+            batch.complete.wait(max(0.0, batch.deadline - time.monotonic()))
+            with self._lock:
+                del self._batches[key]
+            try:
+                batch.result = self.load(merge_sibling_loads(combine_resent_loads(batch.members)))
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+
+        rows_loaded = rows_affected = 0
+        for batch in [batch for _, batch in led] + joined:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            rows_loaded += batch.result[0]
+            rows_affected += batch.result[1]
+        return rows_loaded, rows_affected
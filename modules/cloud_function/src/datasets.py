@@ -0,0 +1,101 @@
+"""Declarative description of the files handled by the ETL."""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Tuple
+
+
+# Suffixes of the compressed variants of the uploads
+COMPRESSION_SUFFIXES = ('.gz', '.zst')
+
+# Columnar uploads, read as Arrow record batches instead of parsed text
+PARQUET_SUFFIX = '.parquet'
+
+
+def is_parquet(file_name: str) -> bool:
+    return file_name.endswith(PARQUET_SUFFIX)
+
+
+def csv_name(file_name: str) -> str:
+    """The registered CSV name of the object, e.g. ``AGE_MONTHLY.csv``.
+
+    Compression suffixes are dropped and ``AGE_MONTHLY.parquet`` stands for
+    the same dataset as ``AGE_MONTHLY.csv``.
+    """
+    if is_parquet(file_name):
+        return file_name[:-len(PARQUET_SUFFIX)] + '.csv'
+    for suffix in COMPRESSION_SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+# File patterns with an ETL function and the table each one writes. A pattern
+# is listed before the shorter ones its name ends with (HOME_REACH_MONTHLY.csv
+# before REACH_MONTHLY.csv), as the first match wins
+DATASET_TABLES = {
+    'AGE_MONTHLY.csv': 'age_wise_user_reaches',
+    'HOME_REACH_MONTHLY.csv': 'mobility_state_wise_user_reaches',
+    'WORK_REACH_MONTHLY.csv': 'mobility_state_wise_user_reaches',
+    'REACH_MONTHLY.csv': 'monthly_overviews',
+    'DEVICE_MONTHLY.csv': 'device_types',
+    'GENDER_MONTHLY.csv': 'gender_nationality_user_reaches',
+    'NATIONALITY_MONTHLY.csv': 'gender_nationality_user_reaches',
+    'MOBILITY_TYPE_MONTHLY.csv': 'mobility_type_wise_user_reaches',
+    'WORK_AVG_DISTANCE_MONTHLY.csv': 'mobility_type_wise_user_reaches',
+    'HOME_AVG_DISTANCE_MONTHLY.csv': 'mobility_type_wise_user_reaches',
+    'REACH_HOURLY.csv': 'hourly_trends',
+    'REACH_DAYS.csv': 'daily_trends',
+}
+
+
+def dataset_key(file_name: str):
+    """The registered file pattern the object name matches, or None."""
+    for key in DATASET_TABLES:
+        if csv_name(file_name).endswith(key):
+            return key
+
+    return None
+
+
+class MissingColumnsError(ValueError):
+    """The file header lacks columns its dataset requires."""
+
+
+@dataclass(frozen=True)
+class ColumnManifest:
+    """Columns a dataset reads and how pandas should parse them.
+
+    Only the columns listed in ``dtypes`` are materialized. Columns listed in
+    ``categorical`` (low-cardinality labels) and ``dates`` (parsed by
+    ``transform.parse_dates``) are read as ``category`` instead.
+    """
+    dtypes: Dict[str, str]
+    categorical: Tuple[str, ...] = ()
+    dates: Tuple[str, ...] = ()
+
+    @property
+    def columns(self):
+        return [*self.dtypes, *[c for c in (*self.dates, *self.categorical) if c not in self.dtypes]]
+
+    def pandas_dtypes(self) -> dict:
+        dtypes = dict(self.dtypes)
+        for column in (*self.dates, *self.categorical):
+            dtypes[column] = 'category'
+        return dtypes
+
+    def validate_header(self, header, file_name: str = '') -> None:
+        missing = [column for column in self.columns if column not in header]
+        if missing:
+            raise MissingColumnsError(f"{file_name} is missing required columns: {', '.join(missing)}")
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """A registered file type: its ETL function, target table and column manifest.
+
+    ``whole_file`` datasets reduce the file to one row per polygon, so their
+    ETL function is given every row at once instead of one chunk at a time.
+    """
+    process: Callable
+    table: str
+    manifest: ColumnManifest = field(repr=False)
+    whole_file: bool = False
@@ -0,0 +1,176 @@
+"""Streaming reads of the uploaded objects."""
+import csv
+import gzip
+import io
+import itertools
+import os
+
+import pandas as pd
+
+from clients import get_storage_client
+
+
+# Rows parsed, transformed and loaded at a time; 0 reads the whole file at once
+DEFAULT_CHUNK_ROWS = 250_000
+
+
+def chunk_rows() -> int:
+    return int(os.getenv('ETL_CHUNK_ROWS', DEFAULT_CHUNK_ROWS))
+
+
+def decompressed(reader, file_name: str):
+    """Wrap ``reader`` so it yields the CSV text of a ``.gz`` or ``.zst`` object.
+
+    Decompression happens as the parser reads, so only the reader's buffers
+    are held in memory. Uncompressed objects are returned as they are.
+    """
+    if file_name.endswith('.gz'):
+        return gzip.GzipFile(fileobj=reader, mode='rb')
+    if file_name.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"{file_name} is zstd-compressed but the zstandard package is not installed")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(reader))
+    return reader
+
+
+def open_object(bucket_name: str, file_name: str):
+    """Open the object as a binary file-like reader that downloads on demand.
+
+    With ``ETL_LOCAL_BUCKET_DIR`` set, objects are read from
+    ``<dir>/<bucket>/<name>`` on the local filesystem instead.
+    """
+    local_dir = os.getenv('ETL_LOCAL_BUCKET_DIR')
+    if local_dir:
+        return open(os.path.join(local_dir, bucket_name, file_name), 'rb')
+
+    storage_client = get_storage_client()
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(file_name)
+    return blob.open('rb')
+
+
+def read_header(reader, manifest=None, file_name: str = ''):
+    """Read the header line only, and check it against the manifest.
+
+    A file missing a required column fails here, before any row is parsed.
+    """
+    line = reader.readline().decode('utf-8-sig')
+    header = next(csv.reader([line]), [])
+    if manifest is not None:
+        manifest.validate_header(header, file_name)
+    return header
+
+
+def read_csv_chunks(reader, rows: int = None, manifest=None, file_name: str = ''):
+    """Yield DataFrames of at most ``rows`` rows parsed from ``reader``.
+
+    Only the current chunk and the reader's download buffer are held in
+    memory, so the footprint follows the chunk size rather than the file size.
+    With a ColumnManifest only its columns are parsed, with pinned dtypes.
+    """
+    rows = chunk_rows() if rows is None else rows
+    options = {}
+    if manifest is not None:
+        header = read_header(reader, manifest, file_name)
+        options = {
+            'header': None,
+            'names': header,
+            'usecols': manifest.columns,
+            'dtype': manifest.pandas_dtypes(),
+        }
+
+    if rows <= 0:
+        yield pd.read_csv(reader, **options)
+        return
+
+    with pd.read_csv(reader, chunksize=rows, **options) as chunks:
+        for chunk in chunks:
+            yield chunk
+
+
+def read_csv_blocks(reader, rows: int = None, manifest=None, file_name: str = '', offset: int = 0):
+    """Yield ``(chunk, offset)`` pairs, ``offset`` being the byte just past the chunk.
+
+    Chunks are cut on line boundaries before parsing, so the offset of each
+    one is exact and a later call can seek straight to it: with ``offset``
+    set, only the header and the bytes after it are read. The files carry no
+    quoted line breaks, so a line is always a row.
+    """
+    rows = chunk_rows() if rows is None else rows
+    header = read_header(reader, manifest, file_name)
+    options = {'header': None, 'names': header}
+    if manifest is not None:
+        options.update(usecols=manifest.columns, dtype=manifest.pandas_dtypes())
+
+    position = reader.tell()
+    if offset > position:
+        if reader.seekable():
+            reader.seek(offset)
+        else:
+            # Decompressed streams can only move forward by reading
+            for _ in iter(lambda: reader.read(min(offset - reader.tell(), 1 << 20)), b''):
+                if reader.tell() >= offset:
+                    break
+        position = offset
+
+    while True:
+        lines = reader.readlines() if rows <= 0 else list(itertools.islice(reader, rows))
+        if not lines:
+            return
+        block = b''.join(lines)
+        position += len(block)
+        yield pd.read_csv(io.BytesIO(block), **options), position
+
+
+def arrow_frame(table, manifest=None):
+    """Convert an Arrow table or record batch to the DataFrame ``read_csv`` would give.
+
+    Date and timestamp columns become ``YYYY-MM-DD`` strings, and the
+    manifest's dtypes are applied. Numeric columns without nulls are
+    handed to pandas without a copy.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns, names = [], []
+    for name, column in zip(table.schema.names, table.columns):
+        if pa.types.is_timestamp(column.type):
+            column = pc.strftime(column, format='%Y-%m-%d')
+        elif pa.types.is_date(column.type):
+            column = column.cast(pa.string())
+        columns.append(column)
+        names.append(name)
+
+    frame = pa.Table.from_arrays(columns, names=names).to_pandas()
+    if manifest is not None:
+        frame = frame.astype(manifest.pandas_dtypes())
+    return frame
+
+
+def read_parquet_chunks(reader, rows: int = None, manifest=None, file_name: str = ''):
+    """Yield DataFrames of at most ``rows`` rows from a Parquet object.
+
+    The object is read one record batch at a time, and with a
+    ColumnManifest only its columns are read, so no text is parsed at all.
+    Parquet keeps its footer at the end, so ``reader`` must be seekable.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError(f"{file_name} is a Parquet file but the pyarrow package is not installed")
+
+    parquet = pq.ParquetFile(reader)
+    columns = None
+    if manifest is not None:
+        manifest.validate_header(parquet.schema_arrow.names, file_name)
+        columns = manifest.columns
+
+    rows = chunk_rows() if rows is None else rows
+    if rows <= 0:
+        yield arrow_frame(parquet.read(columns=columns), manifest)
+        return
+
+    for batch in parquet.iter_batches(batch_size=rows, columns=columns):
+        yield arrow_frame(batch, manifest)
@@ -0,0 +1,144 @@
+"""Row fingerprints: a content hash per conflict key, so re-sent months only load changed rows.
+
+Upstream often re-sends a whole month with a few polygons changed. In delta
+mode every row is hashed after the transform: one 64-bit hash of its
+conflict key and one of the columns it writes. The loader stages only these
+hashes, and rows whose key was loaded before with the same hash are dropped
+before their COPY, so an unchanged re-delivery costs a hash pass instead of
+a rewrite of every tuple. For DO NOTHING tables a known key is enough, as
+the database would keep the stored row anyway.
+
+Fingerprints live in an ``etl_row_fingerprint`` table inside each month
+schema. They are written in the same transaction as the rows they describe
+and dropped along with the month. Files writing different columns of one
+table (GENDER and NATIONALITY, say) keep separate fingerprints. Rows changed
+outside the ETL, or loaded while delta mode was off, are not seen by the
+fingerprints; clear the month's table after such changes. Coalescing of
+sibling files is off in delta mode, as merged loads write several files'
+columns at once.
+"""
+import dataclasses
+import io
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+from clients import ensure_table_once, forget_table
+import metrics
+
+
+FINGERPRINT_TABLE = 'etl_row_fingerprint'
+
+
+def delta_enabled() -> bool:
+    return os.getenv('ETL_DELTA', '0').lower() in ('1', 'true', 'yes')
+
+
+def column_set(table_load) -> int:
+    """Identifies the table and columns a load writes, as a signed 32-bit integer."""
+    signature = '|'.join([
+        table_load.table, ','.join(table_load.conflict_columns), ','.join(value_columns(table_load))
+    ])
+    return zlib.crc32(signature.encode()) - 2 ** 31
+
+
+def value_columns(table_load):
+    # DO UPDATE loads only change their update columns; the rest is set on insert
+    if table_load.update_columns:
+        return list(table_load.update_columns)
+    return [column for column in table_load.columns if column not in table_load.conflict_columns]
+
+
+def _hash(frame) -> pd.Series:
+    return pd.Series(pd.util.hash_pandas_object(frame, index=False).values.view('int64'))
+
+
+def fingerprints(table_load) -> pd.DataFrame:
+    """``column_set``, ``key_hash`` and ``row_hash`` of every row of the load."""
+    frame = table_load.frame
+    return pd.DataFrame({
+        'column_set': column_set(table_load),
+        'key_hash': _hash(frame[list(table_load.conflict_columns)]).values,
+        'row_hash': _hash(frame[value_columns(table_load)]).values,
+    })
+
+
+def _table(schema: str):
+    return sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(FINGERPRINT_TABLE))
+
+
+def ensure_fingerprint_table(cursor, schema: str) -> None:
+    ensure_table_once(cursor, (FINGERPRINT_TABLE, schema), _table(schema).as_string(cursor), sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            table_name text NOT NULL,
+            column_set integer NOT NULL,
+            key_hash bigint NOT NULL,
+            row_hash bigint NOT NULL,
+            PRIMARY KEY (table_name, column_set, key_hash)
+        )
+    """).format(_table(schema)), lock=(FINGERPRINT_TABLE, schema))
+
+
+def forget(schema: str) -> None:
+    """The month schema was dropped; create its table again on the next write."""
+    forget_table((FINGERPRINT_TABLE, schema))
+
+
+def attach_fingerprints(table_load):
+    """The load carrying the fingerprints of its rows, so the loader skips the unchanged ones."""
+    return dataclasses.replace(table_load, fingerprints=fingerprints(table_load))
+
+
+def _staging():
+    return sql.Identifier(f"staging_{FINGERPRINT_TABLE}")
+
+
+def drop_unchanged(cursor, table_load):
+    """The load without the rows whose fingerprint is stored, in the caller's transaction.
+
+    The load's fingerprints are staged for ``record_fingerprints``, which
+    stores them once the remaining rows are upserted.
+    """
+    ensure_fingerprint_table(cursor, table_load.schema)
+    staging = _staging()
+    cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(staging))
+    cursor.execute(sql.SQL(
+        'CREATE TEMPORARY TABLE {} (position integer, column_set integer, key_hash bigint, row_hash bigint) '
+        'ON COMMIT DROP'
+    ).format(staging))
+
+    rows = table_load.fingerprints
+    buffer = io.StringIO()
+    rows.assign(position=range(len(rows)))[['position', 'column_set', 'key_hash', 'row_hash']].to_csv(
+        buffer, header=False, index=False
+    )
+    buffer.seek(0)
+    cursor.copy_expert(sql.SQL('COPY {} FROM STDIN WITH (FORMAT csv)').format(staging).as_string(cursor), buffer)
+
+    # DO NOTHING tables keep the stored row whatever its content, so a known key is enough
+    same_content = sql.SQL('AND stored.row_hash = loaded.row_hash') if table_load.update_columns else sql.SQL('')
+    cursor.execute(sql.SQL("""
+        SELECT loaded.position FROM {} loaded JOIN {} stored
+        ON stored.table_name = %s AND stored.column_set = loaded.column_set AND stored.key_hash = loaded.key_hash
+        {}
+    """).format(staging, _table(table_load.schema), same_content), (table_load.table,))
+    unchanged = np.zeros(len(rows), dtype=bool)
+    unchanged[[position for position, in cursor.fetchall()]] = True
+
+    metrics.increment('rows_unchanged', int(unchanged.sum()))
+    return dataclasses.replace(table_load, frame=table_load.frame[~unchanged])
+
+
+def record_fingerprints(cursor, table_load) -> None:
+    """Store the fingerprints staged by ``drop_unchanged``; unchanged ones are not rewritten."""
+    # A key repeated in the load (with ETL_DEDUP_KEEP=none) is stored once
+    cursor.execute(sql.SQL("""
+        INSERT INTO {target} AS stored (table_name, column_set, key_hash, row_hash)
+        SELECT DISTINCT ON (column_set, key_hash) %s, column_set, key_hash, row_hash FROM {staging}
+        ORDER BY column_set, key_hash, position DESC
+        ON CONFLICT (table_name, column_set, key_hash) DO UPDATE SET row_hash = EXCLUDED.row_hash
+        WHERE stored.row_hash <> EXCLUDED.row_hash
+    """).format(target=_table(table_load.schema), staging=_staging()), (table_load.table,))
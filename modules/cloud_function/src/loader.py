@@ -0,0 +1,607 @@
+"""Bulk loading of transformed frames into the monthly schemas.
+
+Rows are streamed with ``COPY FROM STDIN`` into a temporary staging table and
+moved into the target table by one set-based ``INSERT ... SELECT ... ON
+CONFLICT`` statement, so no SQL text ever grows with the size of the file.
+"""
+import contextlib
+import contextvars
+import dataclasses
+import io
+import os
+import queue
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+import pandas as pd
+from psycopg2 import errors, sql
+
+import fingerprint
+import metrics
+import polygons
+import rollups
+
+
+# Rows serialised per COPY call; bounds the size of the in-memory CSV buffer
+COPY_BATCH_ROWS = 100_000
+
+# Frames with fewer rows are serialised by pandas, so small files never import
+# pyarrow; Arrow's CSV writer pays off on the larger ones
+ARROW_MIN_ROWS = 10_000
+
+# Month schemas loaded at the same time, each over its own connection
+DEFAULT_PARTITION_CONCURRENCY = 4
+
+# Writers a load is split across by a hash of the conflict key; 1 loads by month
+DEFAULT_LOAD_SHARDS = 1
+
+# Marker used for missing values in the COPY stream, so that empty strings
+# (e.g. a missing state or weekday) are still written as ''
+COPY_NULL = '\\N'
+
+# Month schemas are named after their year and month, e.g. 2024_05
+MONTH_SCHEMA_PATTERN = '^[0-9]{4}_[0-9]{2}$'
+
+# Errors of a load whose month schema or table was dropped after the instance saw it
+DROPPED_TARGET_ERRORS = (errors.UndefinedTable, errors.InvalidSchemaName)
+
+
+@dataclass
+class TableLoad:
+    """Rows destined for one table of a monthly schema."""
+    schema: str
+    table: str
+    frame: pd.DataFrame
+    conflict_columns: Tuple[str, ...]
+    update_columns: Tuple[str, ...] = ()
+    # Row fingerprints stored along with the rows in delta mode (see fingerprint.py)
+    fingerprints: Optional[pd.DataFrame] = field(default=None, repr=False)
+
+    @property
+    def columns(self):
+        return list(self.frame.columns)
+
+    @property
+    def target(self):
+        return sql.SQL('{}.{}').format(sql.Identifier(self.schema), sql.Identifier(self.table))
+
+
+def staging_table_name(table_load: TableLoad) -> str:
+    return f"staging_{table_load.table}"
+
+
+def create_staging_table(cursor, table_load: TableLoad) -> None:
+    """Create a temporary table shaped like the target columns.
+
+    Numeric frame columns are staged as ``numeric`` so values such as ``12.0``
+    (integers pandas widened to float because of missing values) are accepted
+    and cast on the way into the target table.
+    """
+    select_list = []
+    for column in table_load.columns:
+        if pd.api.types.is_numeric_dtype(table_load.frame[column].dtype):
+            select_list.append(sql.SQL('{}::numeric AS {}').format(sql.Identifier(column), sql.Identifier(column)))
+        else:
+            select_list.append(sql.Identifier(column))
+
+    staging = sql.Identifier(staging_table_name(table_load))
+    cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(staging))
+    cursor.execute(
+        sql.SQL('CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA').format(
+            staging, sql.SQL(', ').join(select_list), table_load.target
+        )
+    )
+
+
+def arrow_csv():
+    """pyarrow's CSV module, imported on first use; None when pyarrow is not installed."""
+    try:
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+    return pa_csv
+
+
+def arrow_table(frame: pd.DataFrame):
+    """The frame as an Arrow table the CSV writer accepts (categoricals as plain values).
+
+    Returns None for frames Arrow cannot type, e.g. object columns mixing
+    numbers and strings.
+    """
+    import pyarrow as pa
+
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+    fields = [
+        pa.field(field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+        for field in table.schema
+    ]
+    return table.cast(pa.schema(fields))
+
+
+def csv_batches(table_load: TableLoad, batch_rows: int = COPY_BATCH_ROWS):
+    """Serialise the frame into CSV batches; yield ``(arrow, buffer)`` per batch.
+
+    With pyarrow installed, batches of large frames are written by Arrow's
+    CSV writer straight from the column buffers, without a Python object per
+    value (``arrow`` is True). It quotes every string, so an unquoted empty
+    field is a NULL and an empty string stays ''. Other batches mark NULLs
+    as ``COPY_NULL``.
+    """
+    frame = table_load.frame[table_load.columns]
+
+    pa_csv = arrow_csv() if len(frame) >= ARROW_MIN_ROWS else None
+    table = arrow_table(frame) if pa_csv is not None else None
+    if table is not None:
+        options = pa_csv.WriteOptions(include_header=False)
+        for start in range(0, len(frame), batch_rows):
+            buffer = io.BytesIO()
+            pa_csv.write_csv(table.slice(start, batch_rows), buffer, write_options=options)
+            buffer.seek(0)
+            yield True, buffer
+        return
+
+    for start in range(0, len(frame), batch_rows):
+        buffer = io.StringIO()
+        frame.iloc[start:start + batch_rows].to_csv(buffer, header=False, index=False, na_rep=COPY_NULL)
+        buffer.seek(0)
+        yield False, buffer
+
+
+def copy_frame(cursor, table_load: TableLoad, batch_rows: int = COPY_BATCH_ROWS) -> int:
+    """Stream the frame into the staging table in the CSV batches of ``csv_batches``."""
+    staging = sql.Identifier(staging_table_name(table_load))
+    columns = sql.SQL(', ').join(map(sql.Identifier, table_load.columns))
+    copy_statements = {
+        True: sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(staging, columns).as_string(cursor),
+        False: sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+            staging, columns
+        ).as_string(cursor),
+    }
+    for arrow, buffer in csv_batches(table_load, batch_rows):
+        cursor.copy_expert(copy_statements[arrow], buffer)
+
+    return len(table_load.frame)
+
+
+def upsert_statement(table_load: TableLoad):
+    """``INSERT ... SELECT ... ON CONFLICT`` from the staging table into the target."""
+    columns = sql.SQL(', ').join(map(sql.Identifier, table_load.columns))
+    conflict = sql.SQL(', ').join(map(sql.Identifier, table_load.conflict_columns))
+
+    if table_load.update_columns:
+        action = sql.SQL('DO UPDATE SET {}').format(sql.SQL(', ').join(
+            sql.SQL('{} = EXCLUDED.{}').format(sql.Identifier(column), sql.Identifier(column))
+            for column in table_load.update_columns
+        ))
+    else:
+        action = sql.SQL('DO NOTHING')
+
+    # Rows go in key order, so concurrent loads into the same table (sibling
+    # files, other instances) lock the rows they share in the same order
+    # instead of deadlocking
+    return sql.SQL('INSERT INTO {} ({}) SELECT {} FROM {} ORDER BY {} ON CONFLICT ({}) {}').format(
+        table_load.target, columns, columns,
+        sql.Identifier(staging_table_name(table_load)), conflict, conflict, action
+    )
+
+
+def ensure_schema(cursor, schema: str) -> None:
+    # Concurrent CREATE SCHEMA IF NOT EXISTS calls for the same month can
+    # collide, so creators of one schema take turns
+    with metrics.span('ensure_schema'):
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('create_schema_and_tables'), hashtext(%s))", (schema,))
+        cursor.execute('SELECT create_schema_and_tables(%s)', (schema,))
+        schema_registry.refresh(cursor, schema)
+
+
+class SchemaRegistry:
+    """Tables of the month schemas known to exist, shared by every load of the instance.
+
+    It is read from ``information_schema`` on first use and extended after
+    each ``ensure_schema``, so ``create_schema_and_tables`` only runs for
+    a month or table the instance has not seen. A schema whose table turns
+    out to be missing is forgotten and ensured again.
+    """
+
+    def __init__(self):
+        self._tables = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read(cursor, schema: str = None) -> set:
+        if schema is None:
+            cursor.execute(
+                'SELECT table_schema, table_name FROM information_schema.tables WHERE table_schema ~ %s',
+                (MONTH_SCHEMA_PATTERN,)
+            )
+        else:
+            cursor.execute(
+                'SELECT table_schema, table_name FROM information_schema.tables WHERE table_schema = %s',
+                (schema,)
+            )
+        return set(cursor.fetchall())
+
+    def contains(self, cursor, table_load: TableLoad) -> bool:
+        if self._tables is None:
+            tables = self._read(cursor)
+            with self._lock:
+                if self._tables is None:
+                    self._tables = tables
+        return (table_load.schema, table_load.table) in self._tables
+
+    def refresh(self, cursor, schema: str) -> None:
+        tables = self._read(cursor, schema)
+        with self._lock:
+            self._tables = (self._tables or set()) | tables
+
+    def forget(self, schema: str) -> None:
+        with self._lock:
+            if self._tables is not None:
+                self._tables = {table for table in self._tables if table[0] != schema}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables = None
+
+
+schema_registry = SchemaRegistry()
+
+
+def forget_schema(schema: str) -> None:
+    """The month schema was dropped; every cache of its tables starts over."""
+    schema_registry.forget(schema)
+    fingerprint.forget(schema)
+    rollups.forget(schema)
+    polygons.column_types.forget(schema)
+
+
+def target_exists(cursor, table_load: TableLoad) -> bool:
+    cursor.execute('SELECT to_regclass(%s)', (table_load.target.as_string(cursor),))
+    return cursor.fetchone()[0] is not None
+
+
+def load_table(cursor, table_load: TableLoad) -> int:
+    """Load one TableLoad inside the caller's transaction.
+
+    The target schema must already exist (see ``ensure_schema``). Returns the
+    number of rows inserted or updated in the target table.
+    """
+    if table_load.frame.empty:
+        return 0
+    if table_load.fingerprints is not None:
+        with metrics.span('fingerprint'):
+            table_load = fingerprint.drop_unchanged(cursor, table_load)
+        if table_load.frame.empty:
+            return 0
+    table_load = polygons.match_target(cursor, table_load)
+    with metrics.span('copy'):
+        create_staging_table(cursor, table_load)
+        copy_frame(cursor, table_load)
+    with metrics.span('upsert'):
+        statement = upsert_statement(table_load)
+        if rollups.tracked(table_load):
+            statement = rollups.capture_inserted(cursor, table_load, statement)
+        cursor.execute(statement)
+    rows = cursor.rowcount
+    if table_load.fingerprints is not None:
+        with metrics.span('fingerprint'):
+            fingerprint.record_fingerprints(cursor, table_load)
+    metrics.increment('rows_staged', len(table_load.frame))
+    metrics.increment('rows_upserted', rows)
+    return rows
+
+
+class PartitionLoadError(Exception):
+    """Some month schemas failed to load; the others were committed.
+
+    ``committed`` holds the schemas whose rows were committed, empty when
+    nothing of the load was.
+    """
+
+    def __init__(self, errors: dict, committed=()):
+        self.errors = errors
+        self.committed = set(committed)
+        super().__init__('; '.join(f"{schema}: {error}" for schema, error in sorted(errors.items())))
+
+
+class ShardLoadError(PartitionLoadError):
+    """Some shards of a sharded load failed.
+
+    ``errors`` maps ``shard <n>`` to its error. Shards are only committed
+    once every shard has loaded its rows, so the others were rolled back,
+    unless the failure was in the commit itself.
+    """
+
+
+class _CommitGroup:
+    """Shard writers that commit only if each of them loaded its rows."""
+
+    def __init__(self, writers: int):
+        self.barrier = threading.Barrier(writers)
+        self.failed = False
+
+    def ready(self, loaded: bool) -> bool:
+        """Wait for the other writers; True when every one of them loaded."""
+        if not loaded:
+            self.failed = True
+        self.barrier.wait()
+        return not self.failed
+
+
+def load_shards() -> int:
+    return int(os.getenv('ETL_LOAD_SHARDS', DEFAULT_LOAD_SHARDS))
+
+
+def split_by_key(table_load: TableLoad, shards: int):
+    """Yield ``(shard, load)`` for each shard holding rows, by a hash of the conflict key."""
+    frame = table_load.frame
+    hashes = pd.util.hash_pandas_object(frame[list(table_load.conflict_columns)], index=False).values
+    assignment = hashes % shards
+    for shard in range(shards):
+        rows = assignment == shard
+        if not rows.any():
+            continue
+        fingerprints = table_load.fingerprints
+        if fingerprints is not None:
+            fingerprints = fingerprints[rows].reset_index(drop=True)
+        yield shard, dataclasses.replace(table_load, frame=frame[rows], fingerprints=fingerprints)
+
+
+class _PartitionWriter(threading.Thread):
+    """Loads the TableLoads routed to it over one connection and one transaction."""
+
+    _done = object()
+
+    def __init__(self, connect, index: int, skip_schemas=(), on_commit=None, commit_group: _CommitGroup = None):
+        super().__init__(name=f"etl-partition-{index}", daemon=True)
+        # Metrics of the invocation are collected in the writer thread as well
+        self.context = contextvars.copy_context()
+        self.connect = connect
+        self.skip_schemas = set(skip_schemas)
+        self.on_commit = on_commit
+        self.loads = queue.Queue(maxsize=2)
+        self.schemas = []
+        self.rows_loaded = 0
+        self.rows_affected = 0
+        self.only_writer = False
+        self.error = None
+        self.commit_group = commit_group
+        self.voted = False
+        # (schema, table) pairs loaded in the writer's transaction
+        self.targets = set()
+
+    def _pending(self):
+        while True:
+            table_load = self.loads.get()
+            if table_load is self._done:
+                return
+            yield table_load
+
+    def _load(self, conn, cursor, table_load: TableLoad, verified: set) -> int:
+        target = (table_load.schema, table_load.table)
+        if target in verified:
+            return load_table(cursor, table_load)
+
+        if self.commit_group is not None:
+            # Shards wait for each other before committing, so a shard holding
+            # the schema lock would block the others for good. The tables were
+            # ensured before the shards started; a retry ensures them again
+            try:
+                rows = load_table(cursor, table_load)
+            except DROPPED_TARGET_ERRORS:
+                forget_schema(table_load.schema)
+                raise
+        elif not schema_registry.contains(cursor, table_load):
+            # create_schema_and_tables runs for months the instance has not
+            # seen. Before any row is written it is committed on its own, so
+            # other files of the same month do not wait for this load
+            ensure_schema(cursor, table_load.schema)
+            if self.rows_loaded == 0:
+                conn.commit()
+            rows = load_table(cursor, table_load)
+        else:
+            # The table may have been dropped since the registry saw it
+            cursor.execute('SAVEPOINT etl_load_table')
+            try:
+                rows = load_table(cursor, table_load)
+            except DROPPED_TARGET_ERRORS:
+                cursor.execute('ROLLBACK TO SAVEPOINT etl_load_table')
+                forget_schema(table_load.schema)
+                ensure_schema(cursor, table_load.schema)
+                rows = load_table(cursor, table_load)
+            cursor.execute('RELEASE SAVEPOINT etl_load_table')
+
+        verified.add(target)
+        return rows
+
+    def run(self):
+        self.context.run(self._run)
+
+    def _may_commit(self) -> bool:
+        if self.commit_group is None:
+            return self.error is None
+        self.voted = True
+        if not self.commit_group.ready(self.error is None) and self.error is None:
+            self.error = RuntimeError('rolled back because another shard failed')
+        return self.error is None
+
+    def _run(self):
+        try:
+            with self.connect() as conn:
+                with conn.cursor() as cursor:
+                    for table_load in self._pending():
+                        if self.error is not None or table_load.schema in self.skip_schemas:
+                            continue
+                        try:
+                            self.rows_affected += self._load(conn, cursor, table_load, self.targets)
+                            self.rows_loaded += len(table_load.frame)
+                        except Exception as e:
+                            self.error = e
+                    if self.error is None and self.on_commit is not None:
+                        # Runs in the same transaction as the rows it describes
+                        loaded = [schema for schema in self.schemas if schema not in self.skip_schemas]
+                        self.on_commit(cursor, loaded, self.only_writer)
+                if self._may_commit():
+                    # Shards wait for each other before this, so none holds rollup rows while waiting
+                    with conn.cursor() as cursor:
+                        rollups.apply(cursor, self.targets)
+                    conn.commit()
+        except Exception as e:
+            self.error = self.error or e
+            # Keep consuming so the dispatcher never blocks on a dead writer
+            for _ in self._pending():
+                pass
+            if self.commit_group is not None and not self.voted:
+                self.commit_group.ready(False)
+
+
+def load_partitions(table_loads, connect, concurrency: int = None, skip_schemas=(), on_commit=None,
+                    shards: int = None):
+    """Load a stream of TableLoads, routing each month schema to its own writer.
+
+    Every writer runs in its own thread over its own ``connect()`` connection
+    and commits its own transaction, so the months of a multi-month file load
+    in parallel. Schemas beyond ``concurrency`` share writers. Returns
+    ``(rows_loaded, rows_affected)``; raises PartitionLoadError naming the
+    schemas that failed after the others have committed.
+
+    Loads for ``skip_schemas`` are dropped. ``on_commit(cursor, schemas,
+    only_writer)`` runs in each writer's transaction just before its commit.
+
+    With ``shards`` (or ``ETL_LOAD_SHARDS``) above 1 the loads are split
+    across that many writers instead; see ``load_shards_together``.
+    """
+    if polygons.encoding_enabled():
+        polygons.ensure_mapping_functions(connect)
+
+    shards = shards or load_shards()
+    if shards > 1:
+        return load_shards_together(table_loads, connect, shards, skip_schemas, on_commit)
+
+    concurrency = concurrency or int(os.getenv('ETL_PARTITION_CONCURRENCY', DEFAULT_PARTITION_CONCURRENCY))
+    writers = []
+    routes = {}
+
+    try:
+        for table_load in table_loads:
+            writer = routes.get(table_load.schema)
+            if writer is None:
+                if len(writers) < concurrency:
+                    writer = _PartitionWriter(connect, len(writers), skip_schemas, on_commit)
+                    writer.start()
+                    writers.append(writer)
+                else:
+                    writer = writers[len(routes) % concurrency]
+                writer.schemas.append(table_load.schema)
+                routes[table_load.schema] = writer
+            writer.loads.put(table_load)
+    except BaseException as e:
+        # The stream itself failed: roll every writer back
+        for writer in writers:
+            writer.error = writer.error or e
+        raise
+    finally:
+        for writer in writers:
+            writer.only_writer = len(writers) == 1
+            writer.loads.put(_PartitionWriter._done)
+        for writer in writers:
+            writer.join()
+
+    errors = defaultdict(str)
+    for writer in writers:
+        if writer.error is not None:
+            for schema in writer.schemas:
+                errors[schema] = str(writer.error)
+    if errors:
+        committed = {schema for writer in writers if writer.error is None for schema in writer.schemas}
+        raise PartitionLoadError(dict(errors), committed - set(skip_schemas))
+
+    return (
+        sum(writer.rows_loaded for writer in writers),
+        sum(writer.rows_affected for writer in writers),
+    )
+
+
+# Held while a sharded load takes its connections
+_reserving = threading.Lock()
+
+
+def load_shards_together(table_loads, connect, shards: int, skip_schemas=(), on_commit=None):
+    """Load a stream of TableLoads split by conflict key across ``shards`` writers.
+
+    Rows are routed by a hash of their conflict key, so the writers touch
+    disjoint rows and a large table is written by several backends at once.
+    The writers commit together: if one fails, the others roll back and
+    ShardLoadError names the failed shards; only a failure in the commit
+    itself leaves the other shards committed. Schemas and fingerprint tables are
+    created beforehand over one more connection and committed right away, so
+    no writer waits on a lock another writer holds until its commit.
+    ``on_commit`` runs in the first writer's transaction, with
+    ``only_writer`` False.
+
+    The ``shards + 1`` connections are taken before any writer starts, one
+    load at a time, so concurrent sharded loads never each hold part of the
+    pool while they wait for the rest.
+    """
+    group = _CommitGroup(shards)
+    writers = []
+    prepared = set()
+
+    with contextlib.ExitStack() as connections:
+        with _reserving:
+            ddl = connections.enter_context(connect())
+            reserved = [connections.enter_context(connect()) for _ in range(shards)]
+        try:
+            for index, conn in enumerate(reserved):
+                writer = _PartitionWriter(lambda conn=conn: contextlib.nullcontext(conn), index, skip_schemas,
+                                          on_commit if index == 0 else None, group)
+                writer.start()
+                writers.append(writer)
+
+            for table_load in table_loads:
+                if table_load.schema in skip_schemas:
+                    continue
+                target = (table_load.schema, table_load.table)
+                if target not in prepared:
+                    with ddl.cursor() as cursor:
+                        # A month dropped since the registry saw it is created again
+                        # here, as writers recreating it would wait on each other
+                        if schema_registry.contains(cursor, table_load) and not target_exists(cursor, table_load):
+                            forget_schema(table_load.schema)
+                        if not schema_registry.contains(cursor, table_load):
+                            ensure_schema(cursor, table_load.schema)
+                        if table_load.fingerprints is not None:
+                            fingerprint.ensure_fingerprint_table(cursor, table_load.schema)
+                    ddl.commit()
+                    prepared.add(target)
+                    for writer in writers:
+                        if table_load.schema not in writer.schemas:
+                            writer.schemas.append(table_load.schema)
+
+                for shard, rows in split_by_key(table_load, shards):
+                    writers[shard].loads.put(rows)
+        except BaseException as e:
+            # The stream itself failed: roll every writer back
+            for writer in writers:
+                writer.error = writer.error or e
+            raise
+        finally:
+            for writer in writers:
+                writer.loads.put(_PartitionWriter._done)
+            for writer in writers:
+                writer.join()
+
+    errors = {f"shard {index}": str(writer.error) for index, writer in enumerate(writers) if writer.error is not None}
+    if errors:
+        committed = {schema for writer in writers if writer.error is None for schema in writer.schemas}
+        raise ShardLoadError(errors, committed - set(skip_schemas))
+
+    return (
+        sum(writer.rows_loaded for writer in writers),
+        sum(writer.rows_affected for writer in writers),
+    )
@@ -0,0 +1,108 @@
+"""Load manifest: which objects (and which of their month schemas) are loaded.
+
+GCS finalize events are delivered at least once. The manifest lets a
+redelivered event, or the same content uploaded under another name, return
+before anything is downloaded. Partition rows are written in the same
+transaction as the partition's data, so a row exists only for data that is
+committed.
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from clients import ensure_table_once
+
+
+MANIFEST_TABLE = 'etl_load_manifest'
+
+# schema_name of the row recording that every partition of the object is loaded
+WHOLE_OBJECT = ''
+
+
+def manifest_enabled() -> bool:
+    return os.getenv('ETL_LOAD_MANIFEST', '0').lower() in ('1', 'true', 'yes')
+
+
+@dataclass(frozen=True)
+class ObjectIdentity:
+    """An uploaded object version, as described by its finalize event."""
+    bucket: str
+    name: str
+    generation: str
+    dataset: str
+    md5_hash: Optional[str] = None
+    crc32c: Optional[str] = None
+
+    @classmethod
+    def from_event(cls, event: dict, dataset: str):
+        return cls(
+            bucket=event['bucket'],
+            name=event['name'],
+            generation=str(event.get('generation') or ''),
+            dataset=dataset,
+            md5_hash=event.get('md5Hash'),
+            crc32c=event.get('crc32c'),
+        )
+
+
+def ensure_manifest_table(cursor) -> None:
+    ensure_table_once(cursor, MANIFEST_TABLE, MANIFEST_TABLE, f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            bucket text NOT NULL,
+            object_name text NOT NULL,
+            generation text NOT NULL,
+            schema_name text NOT NULL DEFAULT '',
+            dataset text NOT NULL,
+            md5_hash text,
+            crc32c text,
+            loaded_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (bucket, object_name, generation, schema_name)
+        );
+        CREATE INDEX IF NOT EXISTS {MANIFEST_TABLE}_content_idx
+            ON {MANIFEST_TABLE} (dataset, md5_hash, crc32c) WHERE schema_name = '';
+    """, lock=(MANIFEST_TABLE,))
+
+
+def find_loaded(cursor, identity: ObjectIdentity):
+    """Return ``(object_name, generation)`` of a completed load of this object or content."""
+    ensure_manifest_table(cursor)
+    cursor.execute(f"""
+        SELECT object_name, generation FROM {MANIFEST_TABLE}
+        WHERE schema_name = %(whole)s AND (
+            (bucket = %(bucket)s AND object_name = %(name)s AND generation = %(generation)s AND %(generation)s <> '')
+            OR (dataset = %(dataset)s AND md5_hash = %(md5)s AND crc32c IS NOT DISTINCT FROM %(crc32c)s)
+        )
+        LIMIT 1
+    """, {
+        'whole': WHOLE_OBJECT,
+        'bucket': identity.bucket,
+        'name': identity.name,
+        'generation': identity.generation,
+        'dataset': identity.dataset,
+        'md5': identity.md5_hash,
+        'crc32c': identity.crc32c,
+    })
+    return cursor.fetchone()
+
+
+def loaded_partitions(cursor, identity: ObjectIdentity) -> set:
+    """Month schemas of this object version committed by an earlier, unfinished attempt."""
+    ensure_manifest_table(cursor)
+    cursor.execute(f"""
+        SELECT schema_name FROM {MANIFEST_TABLE}
+        WHERE bucket = %s AND object_name = %s AND generation = %s AND schema_name <> %s
+    """, (identity.bucket, identity.name, identity.generation, WHOLE_OBJECT))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def record(cursor, identity: ObjectIdentity, schema: str = WHOLE_OBJECT) -> None:
+    """Record a loaded partition, or the whole object when ``schema`` is omitted."""
+    ensure_manifest_table(cursor)
+    cursor.execute(f"""
+        INSERT INTO {MANIFEST_TABLE} (bucket, object_name, generation, schema_name, dataset, md5_hash, crc32c)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT DO NOTHING
+    """, (
+        identity.bucket, identity.name, identity.generation, schema,
+        identity.dataset, identity.md5_hash, identity.crc32c,
+    ))
@@ -0,0 +1,226 @@
+"""Per-invocation metrics: time spent per stage and counters, exported as one record.
+
+``instrumented`` wraps the entry point. While it runs, ``span`` and
+``increment`` add to the metrics of the current invocation, including from
+the pipeline and partition writer threads it starts (they run in a copy of
+the invoking context). Span times are exclusive: a ``download`` span inside
+a ``parse`` span is not counted twice. Threads working in parallel all add
+to the same stage, so stage times can exceed the invocation's duration.
+
+The record is handed to the exporter named by ``ETL_METRICS_EXPORTER``:
+``log`` (default) prints it as a structured Cloud Logging entry, ``none``
+drops it, and ``package.module:name`` loads a callable that is given the
+record, or a class whose instance is.
+"""
+import functools
+import importlib
+import io
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_current = ContextVar('etl_invocation_metrics', default=None)
+
+
+class InvocationMetrics:
+    """Stage times and counters of one invocation; safe to update from several threads."""
+
+    def __init__(self, **attributes):
+        self.attributes = attributes
+        self.stages = defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+        self.counters = defaultdict(int)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str):
+        stack = self._local.__dict__.setdefault('stack', [])
+        started = time.perf_counter()
+        stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                stage = self.stages[name]
+                stage['seconds'] += elapsed - nested
+                stage['calls'] += 1
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def annotate(self, **attributes) -> None:
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def record(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            if 'rows_staged' in counters:
+                counters['rows_conflicted'] = counters['rows_staged'] - counters.get('rows_upserted', 0)
+            return {
+                **self.attributes,
+                'duration_seconds': round(time.perf_counter() - self.started, 6),
+                'stages': {
+                    name: {'seconds': round(stage['seconds'], 6), 'calls': stage['calls']}
+                    for name, stage in self.stages.items()
+                },
+                'counters': counters,
+                # High-water mark of the instance, which may include earlier invocations
+                'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+
+
+def current():
+    return _current.get()
+
+
+def span(name: str):
+    metrics = _current.get()
+    return metrics.span(name) if metrics is not None else _no_span()
+
+
+@contextmanager
+def _no_span():
+    yield
+
+
+def increment(name: str, value: int = 1) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.increment(name, value)
+
+
+def annotate(**attributes) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.annotate(**attributes)
+
+
+def traced(name: str, iterable):
+    """Iterate ``iterable``, counting the time spent producing each item as ``name``."""
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class MeteredReader(io.BufferedIOBase):
+    """Binary reader that counts the bytes read and the time spent as ``download``."""
+
+    def __init__(self, reader):
+        super().__init__()
+        self.reader = reader
+
+    def _read(self, method, *args):
+        with span('download'):
+            data = method(*args)
+        increment('bytes_read', len(data))
+        return data
+
+    def read(self, size=-1):
+        return self._read(self.reader.read, size)
+
+    def read1(self, size=-1):
+        return self._read(getattr(self.reader, 'read1', self.reader.read), size)
+
+    def readline(self, size=-1):
+        return self._read(self.reader.readline, size)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.reader.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.reader.seek(offset, whence)
+
+    def tell(self):
+        return self.reader.tell()
+
+    def close(self):
+        self.reader.close()
+        super().close()
+
+
+def log_exporter(record: dict) -> None:
+    # A JSON line on stdout becomes a structured entry in Cloud Logging
+    print(json.dumps({'severity': 'INFO', 'message': 'etl metrics', 'etl': record}, default=str), flush=True)
+
+
+_exporter = None
+
+
+def set_exporter(exporter) -> None:
+    """Route the records to ``exporter(record)``; ``None`` restores ``ETL_METRICS_EXPORTER``."""
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter():
+    if _exporter is not None:
+        return _exporter
+
+    name = os.getenv('ETL_METRICS_EXPORTER', 'log')
+    if name == 'log':
+        return log_exporter
+    if name == 'none':
+        return None
+
+    module_name, _, attribute = name.partition(':')
+    exporter = getattr(importlib.import_module(module_name), attribute)
+    if isinstance(exporter, type):
+        exporter = exporter()
+    set_exporter(exporter)
+    return exporter
+
+
+def instrumented(entry_point):
+    """Collect the metrics of each call of a ``(event, context)`` entry point and export them."""
+    @functools.wraps(entry_point)
+    def wrapper(event, context):
+        metrics = InvocationMetrics(
+            bucket=event.get('bucket'),
+            object=event.get('name'),
+            generation=event.get('generation'),
+            size=event.get('size'),
+            status='ok',
+        )
+        token = _current.set(metrics)
+        try:
+            return entry_point(event, context)
+        except BaseException as e:
+            metrics.annotate(status='error', error=str(e))
+            raise
+        finally:
+            _current.reset(token)
+            try:
+                exporter = get_exporter()
+                if exporter is not None:
+                    exporter(metrics.record())
+            except Exception:
+                # Metrics must never fail the load they describe
+                pass
+
+    return wrapper
@@ -0,0 +1,184 @@
+"""Pipelined execution of one file: download, parse/transform and load overlap.
+
+Each stage runs in its own thread and hands its output to the next one over a
+bounded queue, so the network, pandas and Postgres work of the same file run
+at the same time while memory stays bounded by the queue sizes.
+"""
+import contextvars
+import io
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+
+# Items buffered between two stages
+DEFAULT_QUEUE_SIZE = 4
+
+# Bytes read from the object per download step
+DEFAULT_READ_BLOCK_BYTES = 8 * 1024 * 1024
+
+# Seconds between checks for a failed stage while blocked on a queue
+POLL_SECONDS = 0.1
+
+
+def pipeline_enabled() -> bool:
+    return os.getenv('ETL_PIPELINE', '0').lower() in ('1', 'true', 'yes')
+
+
+class PipelineCancelled(Exception):
+    """Raised in a stage when another stage has failed."""
+
+
+class _Done:
+    """End of stream marker."""
+
+
+class _Failed:
+    """Carries the error of an upstream stage to the next one."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class Pipeline:
+    """Bounded queues between stages, with the time each stage spends waiting."""
+
+    def __init__(self, queue_size: int = None):
+        self.queue_size = queue_size or int(os.getenv('ETL_PIPELINE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        self.cancelled = threading.Event()
+        self.waits = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def queue(self):
+        return queue.Queue(maxsize=self.queue_size)
+
+    def _record(self, key: str, started: float) -> None:
+        with self._lock:
+            self.waits[key] += time.perf_counter() - started
+
+    def put(self, q, item, stage: str) -> None:
+        started = time.perf_counter()
+        try:
+            while True:
+                if self.cancelled.is_set():
+                    if isinstance(item, _Failed):
+                        return
+                    raise PipelineCancelled()
+                try:
+                    q.put(item, timeout=POLL_SECONDS)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            self._record(f"{stage}.output", started)
+
+    def get(self, q, stage: str):
+        started = time.perf_counter()
+        try:
+            while True:
+                if self.cancelled.is_set():
+                    raise PipelineCancelled()
+                try:
+                    item = q.get(timeout=POLL_SECONDS)
+                    break
+                except queue.Empty:
+                    continue
+        finally:
+            self._record(f"{stage}.input", started)
+
+        if isinstance(item, _Failed):
+            raise item.error
+        return item
+
+    def iterate(self, q, stage: str):
+        while True:
+            item = self.get(q, stage)
+            if item is _Done:
+                return
+            yield item
+
+    def start(self, stage: str, produce, output) -> threading.Thread:
+        """Run ``produce()`` in a thread, forwarding each item it yields to ``output``."""
+        def run():
+            try:
+                for item in produce():
+                    self.put(output, item, stage)
+                self.put(output, _Done, stage)
+            except PipelineCancelled:
+                pass
+            except BaseException as e:
+                self.put(output, _Failed(e), stage)
+
+        # The stage reports to the metrics of the invocation that started it
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(run,), name=f"etl-{stage}", daemon=True)
+        thread.start()
+        return thread
+
+
+class QueueReader(io.RawIOBase):
+    """Binary file-like view over the blocks arriving on a pipeline queue."""
+
+    def __init__(self, pipeline: Pipeline, blocks, stage: str):
+        self.pipeline = pipeline
+        self.blocks = blocks
+        self.stage = stage
+        self._buffer = b''
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer and not self._eof:
+            block = self.pipeline.get(self.blocks, self.stage)
+            if block is _Done:
+                self._eof = True
+            else:
+                self._buffer = block
+
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def read_blocks(reader, block_bytes: int = None):
+    block_bytes = block_bytes or int(os.getenv('ETL_READ_BLOCK_BYTES', DEFAULT_READ_BLOCK_BYTES))
+    while True:
+        block = reader.read(block_bytes)
+        if not block:
+            return
+        yield block
+
+
+def run_pipelined(reader, transform, load, queue_size: int = None) -> dict:
+    """Run download -> transform -> load for one object.
+
+    ``transform`` takes a binary file-like object and yields TableLoads;
+    ``load`` consumes an iterable of TableLoads and runs in the calling
+    thread. Returns the seconds each stage spent blocked on its input and
+    output queues.
+    """
+    pipeline = Pipeline(queue_size)
+    blocks = pipeline.queue()
+    table_loads = pipeline.queue()
+
+    threads = [
+        pipeline.start('download', lambda: read_blocks(reader), blocks),
+        pipeline.start(
+            'transform',
+            lambda: transform(io.BufferedReader(QueueReader(pipeline, blocks, 'transform'))),
+            table_loads
+        ),
+    ]
+    try:
+        load(pipeline.iterate(table_loads, 'load'))
+    finally:
+        pipeline.cancelled.set()
+        for thread in threads:
+            thread.join()
+
+    return dict(pipeline.waits)
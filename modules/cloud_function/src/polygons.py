@@ -0,0 +1,127 @@
+"""Integer polygon keys: POLYGON_L8 cell ids as 64-bit integers instead of text.
+
+POLYGON_L8 values are H3 cell ids, 15 hex digits such as ``8865a8b6a9fffff``.
+With ``ETL_POLYGON_ENCODING=h3`` every transform works on the integer value
+of the id (``int(id, 16)``): an int64 column instead of a Python string per
+row, and 8-byte index keys where the target table has a ``bigint`` polygon
+column. Tables whose polygon column is still text get the hex id back at
+load time, so months created before the switch keep loading; likewise
+text ids are converted for ``bigint`` columns when the mode is off.
+
+The mapping is reversible and readers use the same functions as the ETL:
+``polygon_text(bigint)`` gives the hex id and ``polygon_id(text)`` the
+integer, both created in the database when the mode is on. Fingerprints
+taken in one mode do not match the other, so the first delta load of a
+month after a switch upserts every row again.
+"""
+import dataclasses
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+
+# Lower-case hex without leading zeros, at most 15 digits: every value maps
+# to an int64 and back to the same text
+CELL_ID_PATTERN = re.compile('^[1-9a-f][0-9a-f]{0,14}$')
+
+# Target column types that hold the integer form
+INTEGER_TYPES = ('bigint',)
+
+
+def polygon_encoding() -> str:
+    return os.getenv('ETL_POLYGON_ENCODING', 'text').lower()
+
+
+def encoding_enabled() -> bool:
+    return polygon_encoding() == 'h3'
+
+
+def encode(column) -> pd.Series:
+    """Cell ids as int64; only the unique ids are converted, like ``parse_dates``."""
+    codes, uniques = pd.factorize(column)
+    invalid = [value for value in uniques if not CELL_ID_PATTERN.match(str(value))]
+    if invalid:
+        raise ValueError(f"{column.name} has values that are not H3 cell ids, e.g. {invalid[0]!r}")
+    ids = np.array([int(value, 16) for value in uniques], dtype=np.int64)
+    return pd.Series(ids.take(codes), index=column.index, dtype=np.int64)
+
+
+def decode(column) -> pd.Series:
+    """The hex ids of an int64 column."""
+    codes, uniques = pd.factorize(column)
+    ids = np.array([format(value, 'x') for value in uniques], dtype=object)
+    return pd.Series(ids.take(codes), index=column.index, dtype=object)
+
+
+class ColumnTypes:
+    """Type of the ``polygon`` column of each target table, read once per instance."""
+
+    def __init__(self):
+        self._types = {}
+        self._lock = threading.Lock()
+
+    def get(self, cursor, schema: str, table: str) -> str:
+        key = (schema, table)
+        if key not in self._types:
+            cursor.execute(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_schema = %s AND table_name = %s AND column_name = 'polygon'",
+                (schema, table)
+            )
+            row = cursor.fetchone()
+            with self._lock:
+                self._types[key] = row[0] if row else None
+        return self._types[key]
+
+    def forget(self, schema: str) -> None:
+        with self._lock:
+            self._types = {key: kind for key, kind in self._types.items() if key[0] != schema}
+
+
+column_types = ColumnTypes()
+
+
+def match_target(cursor, table_load):
+    """The load with the polygon form its target column stores."""
+    frame = table_load.frame
+    if 'polygon' not in frame:
+        return table_load
+    encoded = pd.api.types.is_integer_dtype(frame['polygon'].dtype)
+    if encoded == (column_types.get(cursor, table_load.schema, table_load.table) in INTEGER_TYPES):
+        return table_load
+    with metrics.span('convert_polygons'):
+        frame = frame.assign(polygon=decode(frame['polygon']) if encoded else encode(frame['polygon']))
+    return dataclasses.replace(table_load, frame=frame)
+
+
+_functions_ready = False
+_functions_lock = threading.Lock()
+
+
+def ensure_mapping_functions(connect) -> None:
+    """Create ``polygon_text(bigint)`` and ``polygon_id(text)`` once per instance."""
+    global _functions_ready
+    if _functions_ready:
+        return
+    with _functions_lock:
+        if _functions_ready:
+            return
+        with connect() as conn:
+            with conn.cursor() as cursor:
+                # Concurrent CREATE OR REPLACE calls can collide, so creators take turns
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext('polygon_mapping_functions'))")
+                cursor.execute("""
+                    CREATE OR REPLACE FUNCTION polygon_text(id bigint) RETURNS text
+                    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$ SELECT to_hex(id) $$
+                """)
+                cursor.execute("""
+                    CREATE OR REPLACE FUNCTION polygon_id(cell text) RETURNS bigint
+                    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$ SELECT ('x' || lpad(cell, 16, '0'))::bit(64)::bigint $$
+                """)
+            conn.commit()
+        _functions_ready = True
@@ -0,0 +1,731 @@
+"""Loading of one uploaded file: the ETL functions, the dataset registry and the load paths.
+
+``main`` stays light so events that are skipped do not import pandas, the
+Google clients or psycopg2; it imports this module once an event has a
+registered file to load.
+"""
+import pandas as pd
+from collections import Counter
+
+import checkpoint
+from checkpoint import checkpoints_enabled
+from clients import database_connection
+from coalesce import Coalescer, coalesce_window
+from datasets import DATASET_TABLES, ColumnManifest, Dataset, dataset_key, is_parquet
+from extract import decompressed, open_object, read_csv_blocks, read_csv_chunks, read_parquet_chunks
+from fingerprint import attach_fingerprints, delta_enabled
+from loader import PartitionLoadError, TableLoad, load_partitions
+import manifest
+from manifest import ObjectIdentity, manifest_enabled
+import metrics
+from main import log_message
+from pipeline import pipeline_enabled, run_pipelined
+from transform import (
+    drop_duplicate_keys, prepare_frame, split_by_schema, fill_defaults, latest_per_polygon, pivot_latest
+)
+
+
+class PartialLoadError(Exception):
+    """The load failed after committing part of the object; a retry finishes it."""
+
+
+def is_partial_load(error) -> bool:
+    """Whether a failed load left committed rows or a checkpoint behind."""
+    if isinstance(error, PartitionLoadError):
+        return bool(error.committed)
+    return isinstance(error, PartialLoadError)
+
+
+def load_event(file_data):
+    """Extract, transform and load the registered file of a finalize event."""
+    bucket_name = file_data['bucket']
+    file_name = file_data['name']
+    dataset = find_dataset(file_name)
+
+    try:
+        # Skip redelivered events and content that was already loaded
+        identity = None
+        loaded_schemas = set()
+        if manifest_enabled():
+            identity = ObjectIdentity.from_event(file_data, dataset_key(file_name))
+            previous, loaded_schemas = check_manifest(identity)
+            if previous:
+                log_message(
+                    f"{file_name} was already loaded as {previous[0]} (generation {previous[1]}). Skipping."
+                )
+                metrics.annotate(status='skipped')
+                return
+
+        # Extraction
+        with open_object(bucket_name, file_name) as raw_reader:
+            downloaded = metrics.MeteredReader(raw_reader)
+            reader = decompressed(downloaded, file_name)
+            if coalesce_window() > 0 and not delta_enabled() and coalescer.applies_to(dataset.table):
+                # Wait for sibling files of the same month and upsert them together
+                table_loads = list(stream_table_loads(reader, file_name))
+                rows_loaded, rows_affected = coalescer.submit(dataset_key(file_name), table_loads)
+                if identity:
+                    record_loaded(identity)
+                log_message(f"Coalesced load of {file_name}. Rows loaded: {rows_loaded}. Rows affected: {rows_affected}.")
+
+            elif (checkpoints_enabled() and not dataset.whole_file and not is_parquet(file_name)
+                  and file_data.get('generation')):
+                # Commit chunk by chunk and resume where an earlier attempt stopped
+                execute_checkpointed_load(
+                    reader, file_name, ObjectIdentity.from_event(file_data, dataset_key(file_name)),
+                    record_manifest=identity is not None
+                )
+
+            elif pipeline_enabled() and not is_parquet(file_name):
+                # Download, transform and load run concurrently over bounded queues.
+                # Parquet keeps its footer at the end, so it cannot be read as a stream
+                waits = run_pipelined(
+                    downloaded,
+                    transform=lambda stream: stream_table_loads(decompressed(stream, file_name), file_name),
+                    load=lambda table_loads: execute_load(table_loads, identity, loaded_schemas)
+                )
+                log_message("Pipeline stage waits: " + ', '.join(
+                    f"{stage} {seconds:.2f}s" for stage, seconds in sorted(waits.items())
+                ))
+            else:
+                # Transform, one chunk of rows at a time
+                table_loads = stream_table_loads(reader, file_name)
+
+                # Load
+                execute_load(table_loads, identity, loaded_schemas)
+
+    except Exception as e:
+        log_message(message=getattr(e, 'message', str(e)), level='ERROR')
+        metrics.annotate(status='error', error=str(e))
+        if is_partial_load(e):
+            # Part of the file is in the tables: fail the invocation so the
+            # event is redelivered and the retry completes the load
+            raise
+
+
+def find_dataset(file_name: str):
+    key = dataset_key(file_name)
+    return DATASETS[key] if key else None
+
+
+def query_generator(df, file_name: str = 'file_name.csv'):
+    dataset = find_dataset(file_name)
+    if dataset is None:
+        # Handle cases where no matching ETL function is found
+        log_message(f"{file_name} does not have a ETL function. Skipping.")
+        return None
+
+    func = dataset.process
+    log_message(
+        f"Processing file: {file_name} using {func.__name__} etl"
+    )
+    return func(df)
+
+
+def stream_table_loads(reader, file_name: str, rows: int = None):
+    """Parse the CSV in chunks and yield the TableLoad of each chunk."""
+    dataset = find_dataset(file_name)
+    func = dataset.process
+    log_message(
+        f"Processing file: {file_name} using {func.__name__} etl"
+    )
+
+    # The dataset's manifest decides which columns are parsed and how
+    read_chunks = read_parquet_chunks if is_parquet(file_name) else read_csv_chunks
+    chunks = read_chunks(reader, rows, manifest=dataset.manifest, file_name=file_name)
+    if dataset.whole_file:
+        # These keep one row per polygon, so they need every row of the file
+        chunks = [pd.concat(list(chunks), ignore_index=True)]
+
+    for chunk in metrics.traced('parse', chunks):
+        metrics.increment('rows_parsed', len(chunk))
+        with metrics.span('transform'):
+            table_loads = [drop_duplicate_keys(table_load) for table_load in func(chunk)]
+            if delta_enabled():
+                table_loads = [attach_fingerprints(table_load) for table_load in table_loads]
+        for table_load in table_loads:
+            yield table_load
+
+
+def check_manifest(identity: ObjectIdentity):
+    """Return the earlier completed load of this object, and the schemas a partial one committed."""
+    with database_connection() as conn:
+        with conn.cursor() as cursor:
+            previous = manifest.find_loaded(cursor, identity)
+            schemas = manifest.loaded_partitions(cursor, identity) if previous is None else set()
+        conn.commit()
+    return previous, schemas
+
+
+def record_loaded(identity: ObjectIdentity):
+    with database_connection() as conn:
+        with conn.cursor() as cursor:
+            manifest.record(cursor, identity)
+        conn.commit()
+
+
+def execute_load(table_loads, identity: ObjectIdentity = None, loaded_schemas=()):
+    try:
+        on_commit = None
+        if identity:
+            def on_commit(cursor, schemas, only_writer):
+                # Manifest rows are committed together with the partition's rows
+                for schema in schemas:
+                    manifest.record(cursor, identity, schema)
+                if only_writer:
+                    manifest.record(cursor, identity)
+
+        # Each month schema is loaded over its own pooled connection and transaction
+        rows_loaded, rows_affected = load_partitions(
+            table_loads, connect=database_connection,
+            skip_schemas=loaded_schemas, on_commit=on_commit
+        )
+        if identity:
+            record_loaded(identity)
+
+        # Log successful execution
+        log_message(f"Loaded {rows_loaded} rows. Rows affected: {rows_affected}.")
+        if loaded_schemas:
+            log_message(f"Skipped schemas loaded by an earlier attempt: {', '.join(sorted(loaded_schemas))}.")
+
+    except Exception as e:
+        if is_partial_load(e):
+            # load_event logs it and fails the invocation
+            raise
+        log_message(f"An error occurred: {e}", 'ERROR')
+        metrics.annotate(status='error', error=str(e))
+
+
+def execute_checkpointed_load(reader, file_name: str, identity: ObjectIdentity, record_manifest: bool = False):
+    """Load the object one committed chunk at a time.
+
+    Each chunk's byte offset is saved once its rows are committed: in the same
+    transaction when a single month schema is written, otherwise right after.
+    A chunk replayed after a failure in between upserts the same values again,
+    so the result matches a single-shot load. A failure that leaves committed
+    chunks or a checkpoint behind raises PartialLoadError, so the event is
+    retried and resumes.
+    """
+    dataset = find_dataset(file_name)
+    log_message(
+        f"Processing file: {file_name} using {dataset.process.__name__} etl"
+    )
+
+    with database_connection() as conn:
+        with conn.cursor() as cursor:
+            offset, rows_committed = checkpoint.read_checkpoint(cursor, identity)
+        conn.commit()
+    if offset:
+        log_message(f"Resuming {file_name} at byte {offset} after {rows_committed} committed rows.")
+
+    # Byte offset of the saved checkpoint, 0 while there is none
+    resume_offset = offset
+    rows_loaded = rows_affected = 0
+    try:
+        chunks = read_csv_blocks(reader, manifest=dataset.manifest, file_name=file_name, offset=offset)
+        for chunk, offset in metrics.traced('parse', chunks):
+            metrics.increment('rows_parsed', len(chunk))
+            rows_committed += len(chunk)
+            saved = []
+
+            def on_commit(cursor, schemas, only_writer):
+                if only_writer:
+                    checkpoint.save_checkpoint(cursor, identity, offset, rows_committed)
+                    saved.append(True)
+
+            with metrics.span('transform'):
+                table_loads = dataset.process(chunk) if len(chunk) else []
+                table_loads = [drop_duplicate_keys(table_load) for table_load in table_loads]
+                if delta_enabled():
+                    table_loads = [attach_fingerprints(table_load) for table_load in table_loads]
+            loaded, affected = load_partitions(table_loads, connect=database_connection, on_commit=on_commit)
+            rows_loaded += loaded
+            rows_affected += affected
+            if not saved:
+                with database_connection() as conn:
+                    with conn.cursor() as cursor:
+                        checkpoint.save_checkpoint(cursor, identity, offset, rows_committed)
+                    conn.commit()
+            resume_offset = offset
+
+        # Every chunk is in; the checkpoint is replaced by the manifest entry
+        with database_connection() as conn:
+            with conn.cursor() as cursor:
+                checkpoint.clear_checkpoint(cursor, identity)
+                if record_manifest:
+                    manifest.record(cursor, identity)
+            conn.commit()
+
+    except Exception as e:
+        # Rows of this attempt may be committed without their checkpoint
+        if resume_offset or rows_loaded or is_partial_load(e):
+            raise PartialLoadError(f"{e} (a retry resumes {file_name} at byte {resume_offset})") from e
+        raise
+
+    log_message(f"Loaded {rows_loaded} rows. Rows affected: {rows_affected}.")
+
+
+def process_age_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        # A missing age group is written as the 'nan' label the row-by-row
+        # version produced; as NULL it would never conflict and be inserted again
+        partition = fill_defaults(partition, {'AGE_GROUP': 'nan'})
+        values = pd.DataFrame({
+            'date': partition['date'],
+            'polygon': partition['POLYGON_L8'],
+            'age_group': partition['AGE_GROUP'],
+            'user_reach': partition['USER_REACH'],
+        })
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='age_wise_user_reaches',
+            frame=values,
+            conflict_columns=('polygon', 'age_group'),
+        ))
+
+    return loads
+
+
+def process_reach_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        values = pd.DataFrame({
+            'date': partition['date'],
+            'polygon': partition['POLYGON_L8'],
+            'impressions': partition['IMPRESSIONS'],
+            'user_reach': partition['USER_REACH'],
+            'daily_average_impressions': partition['DAILY_AVERAGE_IMPRESSIONS'],
+            'daily_average_user_reach': partition['DAILY_AVERAGE_USER_REACH'],
+            'weekdays_impressions': partition['WEEKDAYS_IMPRESSIONS'],
+            'weekdays_user_reach': partition['WEEKDAYS_USER_REACH'],
+            'weekends_impressions': partition['WEEKENDS_IMPRESSIONS'],
+            'weekends_user_reach': partition['WEEKENDS_USER_REACH'],
+        })
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='monthly_overviews',
+            frame=values,
+            conflict_columns=('polygon',),
+        ))
+
+    return loads
+
+
+def process_device_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        # A missing brand is written as the 'NULL' label, a missing reach as NULL
+        partition = fill_defaults(partition, {'DEVICE_BRAND': 'NULL'})
+        values = pd.DataFrame({
+            'date': partition['date'],
+            'polygon': partition['POLYGON_L8'],
+            'device_brand': partition['DEVICE_BRAND'],
+            'user_reach': partition['USER_REACH'],
+        })
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='device_types',
+            frame=values,
+            conflict_columns=('polygon', 'device_brand'),
+        ))
+
+    return loads
+
+
+def process_gender_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        # Pivot the user reach of each gender into one row per polygon
+        partition = fill_defaults(partition, {'GENDER': 'OTHER', 'USER_REACH': 0})
+        values = pivot_latest(
+            partition, 'GENDER', 'USER_REACH',
+            categories={'MALE': 'gender_male_reaches', 'FEMALE': 'gender_female_reaches'},
+            other_column='gender_other_reaches'
+        )
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='gender_nationality_user_reaches',
+            frame=values,
+            conflict_columns=('polygon',),
+            update_columns=('gender_male_reaches', 'gender_female_reaches', 'gender_other_reaches'),
+        ))
+
+    return loads
+
+
+def process_nationality_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        # Pivot the user reach of each nationality into one row per polygon
+        partition = fill_defaults(partition, {'NATIONALITY': 'OTHER', 'USER_REACH': 0})
+        values = pivot_latest(
+            partition, 'NATIONALITY', 'USER_REACH',
+            categories={
+                'MALAYSIAN': 'nationality_malaysian_reaches',
+                'NON-MALAYSIAN': 'nationality_non_malaysian_reaches',
+            },
+            other_column='nationality_other_reaches'
+        )
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='gender_nationality_user_reaches',
+            frame=values,
+            conflict_columns=('polygon',),
+            update_columns=(
+                'nationality_malaysian_reaches', 'nationality_non_malaysian_reaches', 'nationality_other_reaches'
+            ),
+        ))
+
+    return loads
+
+
+def process_mobility_type_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        # Pivot the user reach of each mobility type into one row per polygon
+        partition = fill_defaults(partition, {'MOBILITY_TYPE': 'PASSERBY', 'USER_REACH': 0})
+        values = pivot_latest(
+            partition, 'MOBILITY_TYPE', 'USER_REACH',
+            categories={'HOME': 'home_user_reach', 'WORK': 'work_user_reach'},
+            other_column='passerby_user_reach'
+        )
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='mobility_type_wise_user_reaches',
+            frame=values,
+            conflict_columns=('polygon',),
+            update_columns=('home_user_reach', 'work_user_reach', 'passerby_user_reach'),
+        ))
+
+    return loads
+
+
+def process_avg_work_distance(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        # Skip rows with missing avg_work_distance and keep the last value per polygon
+        partition = partition[partition['AVG_WORK_DISTANCE'].notna()]
+        values = latest_per_polygon(partition, {'AVG_WORK_DISTANCE': 'avg_work_distance'})
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='mobility_type_wise_user_reaches',
+            frame=values,
+            conflict_columns=('polygon',),
+            update_columns=('avg_work_distance',),
+        ))
+
+    return loads
+
+
+def process_avg_home_distance(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        # Skip rows with missing avg_home_distance and keep the last value per polygon
+        partition = partition[partition['AVG_HOME_DISTANCE'].notna()]
+        values = latest_per_polygon(partition, {'AVG_HOME_DISTANCE': 'avg_home_distance'})
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='mobility_type_wise_user_reaches',
+            frame=values,
+            conflict_columns=('polygon',),
+            update_columns=('avg_home_distance',),
+        ))
+
+    return loads
+
+
+def process_home_reach_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        partition = fill_defaults(partition, {'HOME_STATE': '', 'USER_REACH': 0})
+        values = pd.DataFrame({
+            'date': partition['date'],
+            'polygon': partition['POLYGON_L8'],
+            'mobility_type': 'HOME',
+            'user_reach': partition['USER_REACH'],
+            'state': partition['HOME_STATE'],
+        })
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='mobility_state_wise_user_reaches',
+            frame=values,
+            conflict_columns=('polygon', 'mobility_type', 'state'),
+        ))
+
+    return loads
+
+
+def process_work_reach_monthly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        partition = fill_defaults(partition, {'WORK_STATE': '', 'USER_REACH': 0})
+        values = pd.DataFrame({
+            'date': partition['date'],
+            'polygon': partition['POLYGON_L8'],
+            'mobility_type': 'WORK',
+            'user_reach': partition['USER_REACH'],
+            'state': partition['WORK_STATE'],
+        })
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='mobility_state_wise_user_reaches',
+            frame=values,
+            conflict_columns=('polygon', 'mobility_type', 'state'),
+        ))
+
+    return loads
+
+
+def process_reach_hourly(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df)
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        partition = fill_defaults(partition, {
+            'DAY': '', 'HOUR': 0, 'IMPRESSIONS': 0, 'USER_REACH': 0,
+            'DAILY_AVERAGE_IMPRESSIONS': 0, 'DAILY_AVERAGE_USER_REACH': 0,
+        })
+        values = pd.DataFrame({
+            'date': partition['date'],
+            'polygon': partition['POLYGON_L8'],
+            'weekday': partition['DAY'],
+            'hour': partition['HOUR'],
+            'impressions': partition['IMPRESSIONS'],
+            'user_reach': partition['USER_REACH'],
+            'daily_average_impressions': partition['DAILY_AVERAGE_IMPRESSIONS'],
+            'daily_average_user_reach': partition['DAILY_AVERAGE_USER_REACH'],
+        })
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='hourly_trends',
+            frame=values,
+            conflict_columns=('polygon', 'weekday', 'hour'),
+        ))
+
+    return loads
+
+
+def process_reach_days(df):
+    # Parse dates, derive the schema and drop rows without a polygon
+    frame = prepare_frame(df, date_column='DATA_DATE')
+
+    # Build one load per month schema the rows belong to
+    loads = []
+    for schema, partition in split_by_schema(frame):
+        partition = fill_defaults(partition, {'DAY': '', 'IMPRESSIONS': 0, 'USER_REACH': 0})
+        values = pd.DataFrame({
+            'date': partition['date'],
+            'polygon': partition['POLYGON_L8'],
+            'weekday': partition['DAY'],
+            'impressions': partition['IMPRESSIONS'],
+            'user_reach': partition['USER_REACH'],
+        })
+
+        loads.append(TableLoad(
+            schema=schema,
+            table='daily_trends',
+            frame=values,
+            conflict_columns=('polygon', 'date'),
+        ))
+
+    return loads
+
+
+# Tables upserted column-wise by several files, which can be coalesced
+COALESCED_TABLES = ('gender_nationality_user_reaches', 'mobility_type_wise_user_reaches')
+
+# ETL function and read columns of each file pattern of ``datasets.DATASET_TABLES``
+# Counts are read as float64, not Int64: a fractional value is rounded by the
+# integer target column, as the row-by-row statements were, instead of failing the file
+DATASET_ETL = {
+    'AGE_MONTHLY.csv': dict(
+        process=process_age_monthly,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'USER_REACH': 'float64'},
+            categorical=('AGE_GROUP',),
+            dates=('MONTH',),
+        ),
+    ),
+    'HOME_REACH_MONTHLY.csv': dict(
+        process=process_home_reach_monthly,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'USER_REACH': 'float64'},
+            categorical=('HOME_STATE',),
+            dates=('MONTH',),
+        ),
+    ),
+    'WORK_REACH_MONTHLY.csv': dict(
+        process=process_work_reach_monthly,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'USER_REACH': 'float64'},
+            categorical=('WORK_STATE',),
+            dates=('MONTH',),
+        ),
+    ),
+    'REACH_MONTHLY.csv': dict(
+        process=process_reach_monthly,
+        manifest=ColumnManifest(
+            dtypes={
+                'POLYGON_L8': 'object',
+                'IMPRESSIONS': 'float64',
+                'USER_REACH': 'float64',
+                'DAILY_AVERAGE_IMPRESSIONS': 'float64',
+                'DAILY_AVERAGE_USER_REACH': 'float64',
+                'WEEKDAYS_IMPRESSIONS': 'float64',
+                'WEEKDAYS_USER_REACH': 'float64',
+                'WEEKENDS_IMPRESSIONS': 'float64',
+                'WEEKENDS_USER_REACH': 'float64',
+            },
+            dates=('MONTH',),
+        ),
+    ),
+    'DEVICE_MONTHLY.csv': dict(
+        process=process_device_monthly,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'USER_REACH': 'float64'},
+            categorical=('DEVICE_BRAND',),
+            dates=('MONTH',),
+        ),
+    ),
+    'GENDER_MONTHLY.csv': dict(
+        process=process_gender_monthly,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'USER_REACH': 'float64'},
+            categorical=('GENDER',),
+            dates=('MONTH',),
+        ),
+        whole_file=True,
+    ),
+    'NATIONALITY_MONTHLY.csv': dict(
+        process=process_nationality_monthly,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'USER_REACH': 'float64'},
+            categorical=('NATIONALITY',),
+            dates=('MONTH',),
+        ),
+        whole_file=True,
+    ),
+    'MOBILITY_TYPE_MONTHLY.csv': dict(
+        process=process_mobility_type_monthly,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'USER_REACH': 'float64'},
+            categorical=('MOBILITY_TYPE',),
+            dates=('MONTH',),
+        ),
+        whole_file=True,
+    ),
+    'WORK_AVG_DISTANCE_MONTHLY.csv': dict(
+        process=process_avg_work_distance,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'AVG_WORK_DISTANCE': 'float64'},
+            dates=('MONTH',),
+        ),
+        whole_file=True,
+    ),
+    'HOME_AVG_DISTANCE_MONTHLY.csv': dict(
+        process=process_avg_home_distance,
+        manifest=ColumnManifest(
+            dtypes={'POLYGON_L8': 'object', 'AVG_HOME_DISTANCE': 'float64'},
+            dates=('MONTH',),
+        ),
+        whole_file=True,
+    ),
+    'REACH_HOURLY.csv': dict(
+        process=process_reach_hourly,
+        manifest=ColumnManifest(
+            dtypes={
+                'HOUR': 'float64',
+                'IMPRESSIONS': 'float64',
+                'USER_REACH': 'float64',
+                'DAILY_AVERAGE_IMPRESSIONS': 'float64',
+                'DAILY_AVERAGE_USER_REACH': 'float64',
+            },
+            # Every polygon repeats once per weekday and hour
+            categorical=('POLYGON_L8', 'DAY'),
+            dates=('MONTH',),
+        ),
+    ),
+    'REACH_DAYS.csv': dict(
+        process=process_reach_days,
+        manifest=ColumnManifest(
+            dtypes={'IMPRESSIONS': 'float64', 'USER_REACH': 'float64'},
+            # Every polygon repeats once per day
+            categorical=('POLYGON_L8', 'DAY'),
+            dates=('DATA_DATE',),
+        ),
+    ),
+}
+
+
+def build_datasets(tables: dict, etl: dict) -> dict:
+    """Dataset of every registered file pattern, in the order of ``tables``."""
+    unmatched = sorted(set(tables) ^ set(etl))
+    if unmatched:
+        raise ValueError(f"File patterns without both a table and an ETL function: {', '.join(unmatched)}")
+    return {key: Dataset(table=table, **etl[key]) for key, table in tables.items()}
+
+
+# Mapping of file patterns to datasets: the ETL function, target table and the columns it reads
+DATASETS = build_datasets(DATASET_TABLES, DATASET_ETL)
+
+# Number of files writing different columns of the same table
+SIBLING_FILES = Counter(dataset.table for dataset in DATASETS.values())
+
+coalescer = Coalescer(
+    load=lambda table_loads: load_partitions(table_loads, connect=database_connection),
+    siblings={table: SIBLING_FILES[table] for table in COALESCED_TABLES},
+)
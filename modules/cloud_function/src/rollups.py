@@ -0,0 +1,286 @@
+"""Rollups: dashboard totals kept next to the base tables of each month schema.
+
+The dashboard sums ``monthly_overviews``, ``mobility_state_wise_user_reaches``,
+``hourly_trends`` and ``daily_trends`` across every polygon on each page view.
+With rollups on, the ETL keeps those totals in companion tables of the same
+month schema, so the dashboard reads a few rows instead:
+
+- ``rollup_state_user_reaches``: reach per mobility type and state
+- ``rollup_hourly_totals``: impressions and reach per weekday and hour
+- ``rollup_daily_totals``: impressions and reach per day
+- ``rollup_monthly_totals``: impressions and reach of the whole month
+- ``rollup_top_polygons``: the ``ETL_ROLLUP_TOP_N`` polygons with the most reach
+
+Every source is a DO NOTHING table, so a stored row never changes and the
+rows an upsert inserts are exactly what the totals lack. The upsert returns
+them into a temporary table and, just before the writer commits, they are
+added to the totals in the same transaction; rows the upsert skipped, such
+as a re-delivered file, are not counted twice. Totals of one month are
+updated one transaction at a time.
+
+Months loaded while rollups were off, or changed outside the ETL, are
+rebuilt from their base tables with ``python rollups.py 2024_05 ...``.
+"""
+import os
+import sys
+from dataclasses import dataclass
+from typing import Tuple
+
+from psycopg2 import sql
+
+from clients import database_connection, ensure_table_once, forget_table
+import metrics
+import polygons
+
+
+# Polygons kept in rollup_top_polygons, ranked by user reach
+DEFAULT_TOP_N = 100
+
+
+def rollups_enabled() -> bool:
+    return os.getenv('ETL_ROLLUPS', '0').lower() in ('1', 'true', 'yes')
+
+
+def top_n() -> int:
+    return int(os.getenv('ETL_ROLLUP_TOP_N', DEFAULT_TOP_N))
+
+
+def _table(schema: str, table: str):
+    return sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(table))
+
+
+def _columns(columns):
+    return sql.SQL(', ').join(map(sql.Identifier, columns))
+
+
+@dataclass(frozen=True)
+class Totals:
+    """Sums of a base table per group, with the number of polygons in the group."""
+    table: str
+    source: str
+    keys: Tuple[Tuple[str, str], ...]
+    sums: Tuple[str, ...]
+
+    @property
+    def columns(self):
+        return [column for column, _ in self.keys] + list(self.sums)
+
+    def create(self, schema: str):
+        keys = [column for column, _ in self.keys]
+        definitions = [sql.SQL('{} {} NOT NULL').format(sql.Identifier(column), sql.SQL(kind))
+                       for column, kind in self.keys]
+        definitions.append(sql.SQL('polygons bigint NOT NULL'))
+        definitions.extend(sql.SQL('{} bigint NOT NULL').format(sql.Identifier(column)) for column in self.sums)
+        return sql.SQL('CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}))').format(
+            _table(schema, self.table), sql.SQL(', ').join(definitions), _columns(keys)
+        )
+
+    def _aggregate(self, rows):
+        keys = _columns([column for column, _ in self.keys])
+        sums = sql.SQL(', ').join(
+            sql.SQL('coalesce(sum({}), 0)').format(sql.Identifier(column)) for column in self.sums
+        )
+        # Rows are written in key order, so concurrent writers lock them in the same order
+        return sql.SQL('SELECT {keys}, count(*), {sums} FROM {rows} GROUP BY {keys} ORDER BY {keys}').format(
+            keys=keys, sums=sums, rows=rows
+        )
+
+    def add(self, schema: str, rows):
+        """``(statement, params)`` adding the totals of ``rows``, a table of newly inserted source rows."""
+        keys = [column for column, _ in self.keys]
+        updates = sql.SQL(', ').join(
+            sql.SQL('{column} = total.{column} + EXCLUDED.{column}').format(column=sql.Identifier(column))
+            for column in ['polygons', *self.sums]
+        )
+        return [(sql.SQL('INSERT INTO {} AS total ({}, polygons, {}) {} ON CONFLICT ({}) DO UPDATE SET {}').format(
+            _table(schema, self.table), _columns(keys), _columns(self.sums),
+            self._aggregate(rows), _columns(keys), updates
+        ), None)]
+
+    def rebuild(self, schema: str):
+        keys = [column for column, _ in self.keys]
+        return [
+            (sql.SQL('DELETE FROM {}').format(_table(schema, self.table)), None),
+            (sql.SQL('INSERT INTO {} ({}, polygons, {}) {}').format(
+                _table(schema, self.table), _columns(keys), _columns(self.sums),
+                self._aggregate(_table(schema, self.source))
+            ), None),
+        ]
+
+
+@dataclass(frozen=True)
+class TopPolygons:
+    """The polygons of a base table with the highest ``rank`` value."""
+    table: str
+    source: str
+    rank: str
+    values: Tuple[str, ...]
+
+    @property
+    def columns(self):
+        return ['date', 'polygon', *self.values]
+
+    def create(self, schema: str, polygon_type: str = 'varchar(20)'):
+        values = sql.SQL(', ').join(sql.SQL('{} bigint').format(sql.Identifier(column)) for column in self.values)
+        return sql.SQL('CREATE TABLE IF NOT EXISTS {} (date date, polygon {} PRIMARY KEY, {})').format(
+            _table(schema, self.table), sql.SQL(polygon_type), values
+        )
+
+    def _ranked(self, rows):
+        return sql.SQL('SELECT {} FROM {} ORDER BY {} DESC NULLS LAST, polygon LIMIT %s').format(
+            _columns(self.columns), rows, sql.Identifier(self.rank)
+        )
+
+    def add(self, schema: str, rows):
+        # Stored rows never change, so the new top is within the old top and the new rows
+        target = _table(schema, self.table)
+        columns = _columns(self.columns)
+        candidates = sql.SQL('(SELECT {columns} FROM {target} UNION ALL SELECT {columns} FROM {rows}) candidates').format(
+            columns=columns, target=target, rows=rows
+        )
+        return [(sql.SQL("""
+            WITH top AS ({ranked}),
+            removed AS (DELETE FROM {target} WHERE polygon NOT IN (SELECT polygon FROM top))
+            INSERT INTO {target} ({columns}) SELECT {columns} FROM top ON CONFLICT (polygon) DO NOTHING
+        """).format(ranked=self._ranked(candidates), target=target, columns=columns), (top_n(),))]
+
+    def rebuild(self, schema: str):
+        return [
+            (sql.SQL('DELETE FROM {}').format(_table(schema, self.table)), None),
+            (sql.SQL('INSERT INTO {} ({}) {}').format(
+                _table(schema, self.table), _columns(self.columns), self._ranked(_table(schema, self.source))
+            ), (top_n(),)),
+        ]
+
+
+ROLLUPS = (
+    Totals('rollup_state_user_reaches', 'mobility_state_wise_user_reaches',
+           keys=(('mobility_type', 'varchar(10)'), ('state', 'varchar(50)')), sums=('user_reach',)),
+    Totals('rollup_hourly_totals', 'hourly_trends',
+           keys=(('weekday', 'varchar(10)'), ('hour', 'int')), sums=('impressions', 'user_reach')),
+    Totals('rollup_daily_totals', 'daily_trends',
+           keys=(('date', 'date'), ('weekday', 'varchar(10)')), sums=('impressions', 'user_reach')),
+    Totals('rollup_monthly_totals', 'monthly_overviews',
+           keys=(('date', 'date'),), sums=('impressions', 'user_reach')),
+    TopPolygons('rollup_top_polygons', 'monthly_overviews', rank='user_reach', values=('impressions', 'user_reach')),
+)
+
+
+def source_columns() -> dict:
+    """Base tables with rollups, and the columns their rollups read."""
+    columns = {}
+    for rollup in ROLLUPS:
+        columns[rollup.source] = list(dict.fromkeys([*columns.get(rollup.source, []), *rollup.columns]))
+    return columns
+
+
+SOURCE_COLUMNS = source_columns()
+
+
+def tracked(table_load) -> bool:
+    """Whether the rows the load inserts are kept for the rollups of its table."""
+    return (
+        rollups_enabled()
+        and table_load.table in SOURCE_COLUMNS
+        and not table_load.update_columns
+        and all(column in table_load.columns for column in SOURCE_COLUMNS[table_load.table])
+    )
+
+
+def _inserted(schema: str, table: str):
+    return sql.Identifier(f"etl_inserted_{schema}_{table}")
+
+
+def _create_inserted(cursor, schema: str, table: str) -> None:
+    cursor.execute(sql.SQL('CREATE TEMPORARY TABLE IF NOT EXISTS {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA').format(
+        _inserted(schema, table), _columns(SOURCE_COLUMNS[table]), _table(schema, table)
+    ))
+
+
+def capture_inserted(cursor, table_load, upsert):
+    """The DO NOTHING ``upsert`` keeping the rows it inserts for ``apply``.
+
+    Its row count is still the number of rows inserted into the target.
+    """
+    _create_inserted(cursor, table_load.schema, table_load.table)
+    columns = _columns(SOURCE_COLUMNS[table_load.table])
+    return sql.SQL('WITH inserted AS ({} RETURNING {}) INSERT INTO {} ({}) SELECT {} FROM inserted').format(
+        upsert, columns, _inserted(table_load.schema, table_load.table), columns, columns
+    )
+
+
+def _lock_month(cursor, schema: str) -> None:
+    # Totals of a month are updated, and their tables created, one transaction at a time
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('etl_rollup'), hashtext(%s))", (schema,))
+
+
+def _create_rollup_tables(cursor, schema: str) -> None:
+    for rollup in ROLLUPS:
+        if isinstance(rollup, TopPolygons):
+            # Polygons are kept in the form their base table stores
+            source_type = polygons.column_types.get(cursor, schema, rollup.source)
+            cursor.execute(rollup.create(schema, 'bigint' if source_type in polygons.INTEGER_TYPES else 'varchar(20)'))
+        else:
+            cursor.execute(rollup.create(schema))
+
+
+def ensure_rollup_tables(cursor, schema: str) -> None:
+    """Create the month's rollup tables; the caller holds ``_lock_month``."""
+    ensure_table_once(
+        cursor, ('etl_rollup', schema), _table(schema, ROLLUPS[-1].table).as_string(cursor),
+        lambda cursor: _create_rollup_tables(cursor, schema)
+    )
+
+
+def forget(schema: str) -> None:
+    """The month schema was dropped; create its tables again on the next write."""
+    forget_table(('etl_rollup', schema))
+
+
+def apply(cursor, targets) -> None:
+    """Add the rows inserted into ``targets`` ((schema, table) pairs) to their rollups.
+
+    Runs in the transaction of the upserts, just before its commit.
+    """
+    targets = sorted((schema, table) for schema, table in targets if table in SOURCE_COLUMNS)
+    if not rollups_enabled() or not targets:
+        return
+    with metrics.span('rollup'):
+        for schema in sorted({schema for schema, _ in targets}):
+            _lock_month(cursor, schema)
+            ensure_rollup_tables(cursor, schema)
+        for schema, table in targets:
+            _create_inserted(cursor, schema, table)
+            for rollup in ROLLUPS:
+                if rollup.source == table:
+                    for statement, params in rollup.add(schema, _inserted(schema, table)):
+                        cursor.execute(statement, params)
+            cursor.execute(sql.SQL('TRUNCATE {}').format(_inserted(schema, table)))
+
+
+def rebuild(cursor, schema: str) -> None:
+    """Recompute every rollup of the month from its base tables."""
+    _lock_month(cursor, schema)
+    forget(schema)
+    ensure_rollup_tables(cursor, schema)
+    for rollup in ROLLUPS:
+        for statement, params in rollup.rebuild(schema):
+            cursor.execute(statement, params)
+
+
+def main(argv=None):
+    schemas = sys.argv[1:] if argv is None else argv
+    if not schemas:
+        print('usage: python rollups.py MONTH_SCHEMA...  (e.g. 2024_05)', file=sys.stderr)
+        return 2
+    for schema in schemas:
+        with database_connection() as conn:
+            with conn.cursor() as cursor:
+                rebuild(cursor, schema)
+            conn.commit()
+        print(f"Rebuilt the rollups of {schema}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
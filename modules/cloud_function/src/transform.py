@@ -0,0 +1,154 @@
+"""Columnar building blocks shared by the process_* transforms in processing.py."""
+import dataclasses
+import os
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+import polygons
+
+
+DATE_FORMAT = "%Y-%m-%d"
+
+# Which row of a repeated conflict key is loaded: 'first', 'last', 'none' to
+# send every row, or 'auto' for what an upsert of the rows one by one would
+# leave: the first for DO NOTHING tables, the last for DO UPDATE tables
+DEFAULT_DEDUP_KEEP = 'auto'
+
+
+def dedup_keep() -> str:
+    return os.getenv('ETL_DEDUP_KEEP', DEFAULT_DEDUP_KEEP).lower()
+
+
+def parse_dates(column):
+    """Parse a date column into (date string, month schema) columns.
+
+    Files carry one month (or at most a few dozen days), so only the unique
+    values go through ``strptime``; the results are broadcast back by code.
+    """
+    codes, uniques = pd.factorize(column)
+    if (codes < 0).any():
+        raise ValueError(f"{column.name} has rows without a date")
+    parsed = [datetime.strptime(value, DATE_FORMAT) for value in uniques]
+    dates = pd.Index([value.strftime(DATE_FORMAT) for value in parsed], dtype=object)
+    schemas = pd.Index([f"{value.year}_{str(value.month).zfill(2)}" for value in parsed], dtype=object)
+    return (
+        pd.Series(dates.take(codes), index=column.index, dtype=object),
+        pd.Series(schemas.take(codes), index=column.index, dtype=object),
+    )
+
+
+def prepare_frame(df, date_column: str = 'MONTH'):
+    """Add ``date``/``schema`` columns and drop the rows without a POLYGON_L8.
+
+    With ``ETL_POLYGON_ENCODING=h3`` POLYGON_L8 becomes its int64 cell id.
+    """
+    if df.empty:
+        return df.assign(date=pd.Series(dtype=object), schema=pd.Series(dtype=object))
+
+    dates, schemas = parse_dates(df[date_column])
+    frame = df.assign(date=dates, schema=schemas)
+    frame = frame[frame['POLYGON_L8'].notna()]
+    metrics.increment('rows_dropped_null_polygon', len(df) - len(frame))
+    if polygons.encoding_enabled():
+        frame = frame.assign(POLYGON_L8=polygons.encode(frame['POLYGON_L8']))
+    return frame
+
+
+def split_by_schema(frame):
+    """Yield ``(schema, rows)`` for each month schema, in order of first appearance."""
+    if frame.empty:
+        return
+    schemas = frame['schema']
+    if (schemas == schemas.iloc[0]).all():
+        yield schemas.iloc[0], frame
+        return
+    for schema, partition in frame.groupby('schema', sort=False):
+        yield schema, partition
+
+
+def fill_defaults(frame, defaults: dict):
+    """Replace missing values column by column, e.g. ``{'GENDER': 'OTHER'}``."""
+    defaults = {column: value for column, value in defaults.items() if column in frame}
+
+    # Categorical columns only accept values that are already categories
+    widened = {
+        column: frame[column].cat.add_categories([value])
+        for column, value in defaults.items()
+        if isinstance(frame[column].dtype, pd.CategoricalDtype) and value not in frame[column].cat.categories
+    }
+    if widened:
+        frame = frame.assign(**widened)
+    return frame.fillna(defaults)
+
+
+def first_seen_polygons(frame):
+    """Polygons in the order they first appear, with the date of that first row."""
+    first = frame.drop_duplicates('POLYGON_L8', keep='first')
+    return pd.DataFrame({'date': first['date'].values, 'polygon': first['POLYGON_L8'].values})
+
+
+def latest_per_polygon(frame, value_columns):
+    """Keep the last value seen for each polygon, ordered by first appearance."""
+    order = first_seen_polygons(frame)['polygon']
+    latest = frame.drop_duplicates('POLYGON_L8', keep='last').set_index('POLYGON_L8')
+    latest = latest.reindex(order)
+    return pd.DataFrame({
+        'date': latest['date'].values,
+        'polygon': order.values,
+        **{target: latest[source].values for source, target in value_columns.items()},
+    })
+
+
+def pivot_latest(frame, category_column: str, value_column: str, categories: dict, other_column: str):
+    """Pivot a long (polygon, category, value) frame into one row per polygon.
+
+    ``categories`` maps category values to output columns; anything else lands
+    in ``other_column``. The last value seen for a (polygon, column) pair wins
+    and pairs that never appear are 0.
+    """
+    columns = list(dict.fromkeys([*categories.values(), other_column]))
+    polygons = first_seen_polygons(frame)
+
+    long = pd.DataFrame({
+        'polygon': frame['POLYGON_L8'].values,
+        'column': frame[category_column].map(categories).astype(object).fillna(other_column).values,
+        'value': frame[value_column].values,
+    })
+    long = long.drop_duplicates(['polygon', 'column'], keep='last')
+    wide = long.pivot(index='polygon', columns='column', values='value')
+    wide = wide.reindex(index=polygons['polygon'], columns=columns).fillna(0)
+
+    value_dtype = frame[value_column].dtype
+    if pd.api.types.is_integer_dtype(value_dtype):
+        wide = wide.astype(value_dtype)
+
+    return pd.DataFrame({
+        'date': polygons['date'].values,
+        'polygon': polygons['polygon'].values,
+        **{column: wide[column].values for column in columns},
+    })
+
+
+def drop_duplicate_keys(table_load, keep: str = None):
+    """The load with one row per conflict key, counting the others as ``rows_deduplicated``.
+
+    A DO UPDATE upsert fails on a key it meets twice, and a DO NOTHING one
+    probes the index for every copy. Rows with a missing key column never
+    conflict in Postgres, so they are all kept.
+    """
+    keep = keep or dedup_keep()
+    if keep == 'auto':
+        keep = 'last' if table_load.update_columns else 'first'
+    if keep == 'none':
+        return table_load
+
+    keys = table_load.frame[list(table_load.conflict_columns)]
+    duplicated = keys.duplicated(keep=keep)
+    if not duplicated.any():
+        return table_load
+    duplicated &= keys.notna().all(axis=1)
+
+    metrics.increment('rows_deduplicated', int(duplicated.sum()))
+    return dataclasses.replace(table_load, frame=table_load.frame[~duplicated.values])
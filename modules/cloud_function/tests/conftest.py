@@ -0,0 +1,130 @@
+"""Fixtures running the ETL against a throwaway Postgres started with pgserver.
+
+Each test gets a fresh database with the stand-in ``create_schema_and_tables``
+of ``bench/schema.sql``, ``data/uploads`` as the trigger bucket and cleared
+instance caches, as on a new Cloud Functions instance. ``data/expected``
+holds the tables the row-by-row baseline ETL left after loading every upload.
+
+    pip install -r src/requirements.txt -r tests/requirements.txt
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import uuid
+
+import pytest
+
+pgserver = pytest.importorskip('pgserver')
+
+import psycopg2  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import clients  # noqa: E402
+import loader  # noqa: E402
+import metrics  # noqa: E402
+import polygons  # noqa: E402
+
+
+UPLOADS = os.path.join(HERE, 'data', 'uploads')
+EXPECTED = os.path.join(HERE, 'data', 'expected')
+SCHEMA_SQL = os.path.join(HERE, '..', 'bench', 'schema.sql')
+
+# Month schema of every upload
+SCHEMA = '2024_05'
+
+FILES = sorted(os.listdir(UPLOADS))
+TABLES = sorted(name[:-len('.csv')] for name in os.listdir(EXPECTED))
+
+
+def reset_instance() -> None:
+    """Drop every per-instance cache of the ETL."""
+    clients.reset_connection_pool()
+    clients.database_secrets.invalidate()
+    loader.schema_registry.clear()
+    with clients._tables_lock:
+        clients._tables_ready.clear()
+        clients._table_creators.clear()
+    polygons.column_types = polygons.ColumnTypes()
+    polygons._functions_ready = False
+
+
+@pytest.fixture(scope='session')
+def postgres(tmp_path_factory):
+    server = pgserver.get_server(tmp_path_factory.mktemp('pgdata'), cleanup_mode='stop')
+    yield server
+    server.cleanup()
+
+
+@pytest.fixture
+def database(postgres, monkeypatch):
+    """Connection to a new database the ETL is pointed at."""
+    name = f"etl_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(postgres.get_uri('postgres'))
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'CREATE DATABASE {name}')
+    admin.close()
+
+    conn = psycopg2.connect(postgres.get_uri(name))
+    with conn.cursor() as cursor:
+        with open(SCHEMA_SQL) as handle:
+            cursor.execute(handle.read())
+    conn.commit()
+
+    for key in list(os.environ):
+        if key.startswith('ETL_'):
+            monkeypatch.delenv(key)
+    monkeypatch.setenv('ETL_DATABASE_DSN', postgres.get_uri(name))
+    monkeypatch.setenv('ETL_LOCAL_BUCKET_DIR', os.path.dirname(UPLOADS))
+    reset_instance()
+    yield conn
+    conn.close()
+    reset_instance()
+
+
+@pytest.fixture
+def etl():
+    """Run the entry point on an upload and return its metrics record."""
+    from main import etl as entry_point
+
+    def run(name: str, **event):
+        records = []
+        metrics.set_exporter(records.append)
+        try:
+            entry_point({'bucket': os.path.basename(UPLOADS), 'name': name, 'size': 0, **event}, None)
+        finally:
+            metrics.set_exporter(None)
+        return records[0]
+
+    return run
+
+
+def dump_table(conn, table: str, schema: str = SCHEMA) -> str:
+    """The table as sorted CSV without ``id``, with polygons as hex ids."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = %s AND table_name = %s AND column_name <> 'id' ORDER BY ordinal_position",
+            (schema, table)
+        )
+        columns = [
+            f'polygon_text({column}) AS {column}' if column == 'polygon' and kind == 'bigint' else column
+            for column, kind in cursor.fetchall()
+        ]
+        names = ', '.join(column.split(' AS ')[-1] for column in columns)
+        buffer = io.StringIO()
+        cursor.copy_expert(
+            f'COPY (SELECT {", ".join(columns)} FROM "{schema}".{table} ORDER BY {names}) '
+            f'TO STDOUT WITH (FORMAT csv, HEADER)',
+            buffer
+        )
+    conn.rollback()
+    return buffer.getvalue()
+
+
+def expected_table(table: str) -> str:
+    with open(os.path.join(EXPECTED, f'{table}.csv')) as handle:
+        return handle.read()
@@ -0,0 +1,63 @@
+"""The connection pool follows the database secrets as they are refreshed."""
+import json
+import time
+
+import psycopg2
+
+import clients
+
+
+def write_secrets(path, settings: dict) -> None:
+    values = {'password': '', 'port': '5432', **settings}
+    with open(path, 'w') as handle:
+        json.dump({secret_id: values[key] for key, secret_id in clients.DATABASE_SECRETS.items()}, handle)
+
+
+def current_database() -> str:
+    with clients.database_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT current_database()')
+            return cursor.fetchone()[0]
+
+
+def wait_for_secrets(dbname: str) -> None:
+    deadline = time.monotonic() + 10
+    while clients.database_secrets.get()['dbname'] != dbname:
+        assert time.monotonic() < deadline, 'the secrets were not refreshed'
+        time.sleep(0.05)
+
+
+def test_pool_replaced_when_refreshed_secrets_change(database, monkeypatch, tmp_path):
+    settings = psycopg2.extensions.parse_dsn(database.dsn)
+    secrets = tmp_path / 'secrets.json'
+    write_secrets(secrets, settings)
+    monkeypatch.delenv('ETL_DATABASE_DSN')
+    monkeypatch.setenv('ETL_SECRETS_FILE', str(secrets))
+    monkeypatch.setenv('ETL_SECRET_TTL_SECONDS', '0')
+
+    assert current_database() == settings['dbname']
+    first = clients.get_connection_pool()
+
+    # The database moved; the stale secrets are served while they are refreshed
+    write_secrets(secrets, {**settings, 'dbname': 'postgres'})
+    wait_for_secrets('postgres')
+
+    assert current_database() == 'postgres'
+    assert first.retired
+
+
+def test_failed_refresh_is_logged_and_cached_secrets_kept(database, monkeypatch, tmp_path, caplog):
+    settings = psycopg2.extensions.parse_dsn(database.dsn)
+    secrets = tmp_path / 'secrets.json'
+    write_secrets(secrets, settings)
+    monkeypatch.delenv('ETL_DATABASE_DSN')
+    monkeypatch.setenv('ETL_SECRETS_FILE', str(secrets))
+    monkeypatch.setenv('ETL_SECRET_TTL_SECONDS', '0')
+    assert current_database() == settings['dbname']
+
+    secrets.unlink()
+    deadline = time.monotonic() + 10
+    while 'Refreshing the database secrets failed' not in caplog.text:
+        assert time.monotonic() < deadline, 'the failed refresh was not logged'
+        assert current_database() == settings['dbname']
+        time.sleep(0.05)
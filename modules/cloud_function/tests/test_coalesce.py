@@ -0,0 +1,44 @@
+"""Sibling files are merged into one upsert without losing any file's rows."""
+import threading
+import time
+
+import pandas as pd
+
+from coalesce import Coalescer
+from loader import TableLoad
+
+
+def gender_load(values: dict) -> TableLoad:
+    return TableLoad(
+        schema='2024_05',
+        table='gender_nationality_user_reaches',
+        frame=pd.DataFrame({
+            'date': pd.Timestamp('2024-05-01').date(),
+            'polygon': list(values),
+            'male': list(values.values()),
+        }),
+        conflict_columns=('polygon', 'date'),
+        update_columns=('male',),
+    )
+
+
+def test_resent_file_within_window_keeps_rows_of_both():
+    loaded = []
+
+    def load(table_loads):
+        loaded.extend(table_loads)
+        return sum(len(table_load.frame) for table_load in table_loads), 0
+
+    coalescer = Coalescer(load, siblings={'gender_nationality_user_reaches': 2}, window=0.5)
+    first = threading.Thread(
+        target=coalescer.submit, args=('GENDER_MONTHLY.csv', [gender_load({'a': 1, 'b': 2})])
+    )
+    first.start()
+    # A corrected re-send of the same file type joins the batch the first file leads
+    while not coalescer._batches:
+        time.sleep(0.01)
+    assert coalescer.submit('GENDER_MONTHLY.csv', [gender_load({'b': 20, 'c': 30})]) == (3, 0)
+    first.join()
+
+    rows = pd.concat([table_load.frame for table_load in loaded]).set_index('polygon')['male']
+    assert rows.sort_index().to_dict() == {'a': 1, 'b': 20, 'c': 30}
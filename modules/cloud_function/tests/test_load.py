@@ -0,0 +1,165 @@
+"""Uploads loaded through the entry point leave the tables the baseline ETL left."""
+import os
+
+import pytest
+
+from conftest import FILES, SCHEMA, TABLES, UPLOADS, dump_table, expected_table
+
+
+@pytest.mark.parametrize('settings', [
+    {},
+    {'ETL_CHUNK_ROWS': '40'},
+    {'ETL_DELTA': '1'},
+    {'ETL_LOAD_SHARDS': '3'},
+], ids=['default', 'chunked', 'delta', 'shards'])
+def test_load_matches_baseline(database, etl, monkeypatch, settings):
+    for key, value in settings.items():
+        monkeypatch.setenv(key, value)
+
+    for name in FILES:
+        assert etl(name)['status'] == 'ok', name
+
+    for table in TABLES:
+        assert dump_table(database, table) == expected_table(table), table
+
+
+def drop_schema(conn, schema: str = SCHEMA) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA "{schema}" CASCADE')
+    conn.commit()
+
+
+@pytest.mark.parametrize('settings', [
+    {},
+    {'ETL_DELTA': '1'},
+    {'ETL_DELTA': '1', 'ETL_LOAD_SHARDS': '3'},
+], ids=['default', 'delta', 'delta-shards'])
+def test_reload_after_month_schema_dropped(database, etl, monkeypatch, settings):
+    for key, value in settings.items():
+        monkeypatch.setenv(key, value)
+    assert etl('REACH_HOURLY.csv')['status'] == 'ok'
+
+    # The instance still has the schema and its tables cached
+    drop_schema(database)
+    assert etl('REACH_HOURLY.csv')['status'] == 'ok'
+
+    assert dump_table(database, 'hourly_trends') == expected_table('hourly_trends')
+
+
+def test_duplicate_keys_collapsed_before_upsert(database, etl):
+    record = etl('AGE_MONTHLY.csv')
+
+    # The upload repeats keys; only one row per key reaches the database
+    assert record['counters']['rows_deduplicated'] > 0
+    assert record['counters']['rows_conflicted'] == 0
+    assert dump_table(database, 'age_wise_user_reaches') == expected_table('age_wise_user_reaches')
+
+
+def test_delta_reload_upserts_nothing(database, etl, monkeypatch):
+    monkeypatch.setenv('ETL_DELTA', '1')
+    for name in FILES:
+        assert etl(name)['status'] == 'ok', name
+
+    for name in FILES:
+        record = etl(name)
+        assert record['status'] == 'ok', name
+        assert record['counters'].get('rows_upserted', 0) == 0, name
+        assert record['counters']['rows_unchanged'] > 0, name
+
+    for table in TABLES:
+        assert dump_table(database, table) == expected_table(table), table
+
+
+@pytest.mark.parametrize('polygon_type', ['varchar(20)', 'bigint'])
+def test_h3_load_matches_baseline(database, etl, monkeypatch, polygon_type):
+    # The stand-in creates its polygon columns with the type set on the database
+    with database.cursor() as cursor:
+        cursor.execute(f"ALTER DATABASE {database.info.dbname} SET bench.polygon_type = '{polygon_type}'")
+    database.commit()
+    monkeypatch.setenv('ETL_POLYGON_ENCODING', 'h3')
+
+    for name in FILES:
+        assert etl(name)['status'] == 'ok', name
+
+    with database.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = 'polygon'",
+            (f'"{SCHEMA}".hourly_trends',)
+        )
+        assert cursor.fetchall() == [('bigint' if polygon_type == 'bigint' else 'character varying(20)',)]
+    database.rollback()
+
+    for table in TABLES:
+        assert dump_table(database, table) == expected_table(table), table
+
+
+def test_checkpointed_load_resumes_after_failure(database, etl, monkeypatch):
+    import processing
+
+    monkeypatch.setenv('ETL_CHECKPOINTS', '1')
+    monkeypatch.setenv('ETL_CHUNK_ROWS', '50')
+    load_partitions = processing.load_partitions
+    calls = []
+
+    def failing_third_chunk(*args, **kwargs):
+        calls.append(True)
+        if len(calls) == 3:
+            raise RuntimeError('instance stopped')
+        return load_partitions(*args, **kwargs)
+
+    monkeypatch.setattr(processing, 'load_partitions', failing_third_chunk)
+    # Two chunks are committed, so the invocation fails for the event to be redelivered
+    with pytest.raises(processing.PartialLoadError):
+        etl('REACH_HOURLY.csv', generation='1')
+
+    # The retry starts after the two committed chunks of the 300 rows
+    record = etl('REACH_HOURLY.csv', generation='1')
+    assert record['status'] == 'ok'
+    assert record['counters']['rows_parsed'] == 200
+
+    # A finished load leaves no checkpoint behind
+    with database.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM etl_load_checkpoint')
+        assert cursor.fetchone() == (0,)
+    database.rollback()
+
+    assert dump_table(database, 'hourly_trends') == expected_table('hourly_trends')
+
+
+def two_month_upload(tmp_path, monkeypatch) -> str:
+    """REACH_DAYS with its later half moved to June, in a bucket the ETL reads."""
+    with open(os.path.join(UPLOADS, 'REACH_DAYS.csv')) as handle:
+        lines = handle.read().splitlines()
+    half = len(lines) // 2
+    lines[half:] = [line.replace('2024-05-', '2024-06-', 1) for line in lines[half:]]
+    (tmp_path / 'uploads').mkdir()
+    (tmp_path / 'uploads' / 'REACH_DAYS.csv').write_text('\n'.join(lines) + '\n')
+    monkeypatch.setenv('ETL_LOCAL_BUCKET_DIR', str(tmp_path))
+    return 'REACH_DAYS.csv'
+
+
+@pytest.mark.parametrize('failing', [('2024_06',), ('2024_05', '2024_06')], ids=['one-month', 'all-months'])
+def test_failed_month_retried_only_when_others_committed(database, etl, monkeypatch, tmp_path, failing):
+    import loader
+
+    name = two_month_upload(tmp_path, monkeypatch)
+    load_table = loader.load_table
+
+    def failing_months(cursor, table_load):
+        if table_load.schema in failing:
+            raise RuntimeError('connection lost')
+        return load_table(cursor, table_load)
+
+    monkeypatch.setattr(loader, 'load_table', failing_months)
+    if len(failing) == 1:
+        # May is committed: the invocation fails so the event is redelivered
+        with pytest.raises(loader.PartitionLoadError) as error:
+            etl(name)
+        assert error.value.committed == {'2024_05'}
+    else:
+        # Nothing was written, as in a failed single-shot load
+        assert etl(name)['status'] == 'error'
+
+    monkeypatch.setattr(loader, 'load_table', load_table)
+    assert etl(name)['status'] == 'ok'
@@ -33,3 +33,15 @@ variable "vpc_connector" {
   type    = string
   description = "The VPC connector to use for the Cloud Function"
 }
+
+variable "max_instance_request_concurrency" {
+  type        = number
+  description = "Number of events a single Cloud Function instance handles at the same time"
+  default     = 1
+}
+
+variable "etl_environment_variables" {
+  type        = map(string)
+  description = "Extra ETL settings passed to the Cloud Function as environment variables (e.g. ETL_CHUNK_ROWS)"
+  default     = {}
+}
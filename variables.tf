@@ -263,6 +263,19 @@ variable "cloud_storage_trigger_bucket_name" {
   type        = string
 }
 
+// Cloud Function Module
+variable "cloud_function_max_instance_request_concurrency" {
+  description = "Number of events a single Cloud Function instance handles at the same time"
+  type        = number
+  default     = 1
+}
+
+variable "cloud_function_etl_environment_variables" {
+  description = "Extra ETL settings for the Cloud Function, e.g. { ETL_CHUNK_ROWS = \"250000\" }"
+  type        = map(string)
+  default     = {}
+}
+
 variable "create_cloud_func_storage_bucket" {
   description = "Create the Cloud Storage bucket"
   type        = bool